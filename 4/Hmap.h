@@ -0,0 +1,18 @@
+//-----------------------------------------------------------------------------
+// File: Hmap.h
+// Description: a map<string, TH1*>, used to build a RooDataHist from
+//              one histogram per category (see exercise_4.py)
+//-----------------------------------------------------------------------------
+#ifndef HMAP_H
+#define HMAP_H
+#include <map>
+#include <string>
+#include "TH1.h"
+
+struct Hmap
+{
+  void add(std::string name, TH1* h) {hmap[name] = h;}
+  std::map<std::string, TH1*> hmap;
+  std::map<std::string, TH1*>& operator()(){return hmap;}
+};
+#endif
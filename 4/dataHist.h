@@ -0,0 +1,32 @@
+//-----------------------------------------------------------------------------
+// File: dataHist.h
+// Description: fill a binned dataset over (x, cat) from an array of
+//              counts in one call (see makeDataHist in exercise_4.py)
+//-----------------------------------------------------------------------------
+#ifndef DATAHIST_H
+#define DATAHIST_H
+#include "RooArgSet.h"
+#include "RooRealVar.h"
+#include "RooCategory.h"
+#include "RooDataHist.h"
+
+// counts[c*nbins + i] is the count in bin i of x for the category with
+// index c. As for a histogram without sum of weights squared, the
+// variance of each bin is set to its count.
+void fillDataHist(RooDataHist& data, RooRealVar& x, RooCategory& cat,
+                  int ncat, int nbins, const double* counts)
+{
+  RooArgSet row(x, cat);
+  for(int c=0; c < ncat; c++)
+    {
+      cat.setIndex(c);
+      for(int i=0; i < nbins; i++)
+        {
+          double w = counts[c*nbins + i];
+          if ( w == 0 ) continue;
+          x.setBin(i);
+          data.add(row, w, w);
+        }
+    }
+}
+#endif
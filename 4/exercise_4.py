@@ -8,26 +8,60 @@ import os,sys
 from time import sleep
 from histutil import *
 from ROOT import *
+import numpy as np
 #------------------------------------------------------------------
-# make a histogram for each di-photon category
-def makeHistograms(table, prefix=''):
+# read the di-photon mass table: returns (mmin, mmax, categories,
+# counts), where counts[ii, jj] is the count in mass bin jj for
+# category ii. table is either a Table or the name of a table file;
+# a file is read chunksize rows at a time so that memory use does
+# not grow beyond that of the columns themselves.
+def readTable(table, chunksize=100000):
+    if type(table) == type(''):
+        chunks = Table.iter_chunks(table, max(2, chunksize))
+        first  = next(chunks)
+    else:
+        chunks = iter([])
+        first  = table
+
+    # first column is the mass, so skip it
+    variables = first.variables()[1:]
+    ncols = len(variables)
+
+    # gather the columns one chunk of rows at a time
+    columns = [[] for ii in xrange(ncols+1)]
+    chunk = first
+    while chunk != None:
+        for ii in xrange(ncols+1):
+            columns[ii].append(np.asarray(chunk.column(ii), dtype=np.float64))
+        chunk = next(chunks, None)
+    mass   = np.concatenate(columns[0])
+    counts = np.array([np.concatenate(c) for c in columns[1:]])
+
     # determine minimum and maximum di-photon mass
-    mass0 = table[0][0]       # mass for row 0
-    mass1 = table[1][0]       # mass for row 1
-    massn = table[-1][0]      # mass for last row
+    mass0 = mass[0]           # mass for row 0
+    mass1 = mass[1]           # mass for row 1
+    massn = mass[-1]          # mass for last row
     mstep = mass1-mass0       # mass step size
     mmin  = mass0-0.5*mstep   # minimum mass
     mmax  = massn+0.5*mstep   # maximum mass
 
-    # first column is the mass, so skip it
-    variables = table.variables()[1:]
-    nrows = len(table)
-    ncols = len(variables)
+    nrows = len(mass)
     print 
     print 'bins: %4d\tcategories: %4d\tmin, max: %5.1f, %5.1f GeV' % \
       (nrows, ncols, mmin, mmax)
+    return (mmin, mmax, variables, counts)
+#------------------------------------------------------------------
+# make a histogram for each di-photon category.
+# table is a Table, the name of a table file, or the result of
+# readTable.
+def makeHistograms(table, prefix='', chunksize=100000):
+    if type(table) != type(()):
+        table = readTable(table, chunksize)
+    mmin, mmax, variables, counts = table
+    ncols, nrows = counts.shape
 
-    # create a histogram for each category
+    # create a histogram for each category and set its contents
+    # in one call
     h = [None]*ncols
     xtitle = '#font[12]{m_{#gamma#gamma}} (GeV)'
     for ii, name in enumerate(variables):
@@ -39,8 +73,7 @@ def makeHistograms(table, prefix=''):
         h[ii].GetXaxis().SetTitleOffset(0.95)
         h[ii].GetYaxis().SetTitleOffset(1.15)
         h[ii].GetYaxis().SetTitleSize(0.08)
-        for jj in xrange(nrows):
-            h[ii].SetBinContent(jj+1, table[jj][ii+1])
+        sethist(h[ii], counts[ii])
     return h
 #------------------------------------------------------------------    
 def plotHistograms(h, filename, title,
@@ -53,22 +86,106 @@ def plotHistograms(h, filename, title,
     c.Update()
     return c
 #------------------------------------------------------------------
-# create a map<string, TH1*> 
-def makeHmap():
-    gROOT.ProcessLine('''
-    #include <map>
-    #include <string>
-    #include "TH1.h"
-    struct Hmap
-    {
-      void add(std::string name, TH1* h) {hmap[name] = h;}
-      std::map<std::string, TH1*> hmap;
-      std::map<std::string, TH1*>& operator()(){return hmap;}
-    };
-    ''')
-    from ROOT import Hmap
-    hmap = Hmap()
-    return hmap        
+# create a binned dataset over (x, cat) directly from the counts
+# arrays of readTable, without intermediate histograms. The rows of
+# counts are the categories in the order in which they were defined
+# in cat; the columns are the bins of x (see dataHist.h).
+def makeDataHist(name, x, cat, counts):
+    buildLibrary('dataHist.h')
+    from ROOT import fillDataHist
+    counts = np.ascontiguousarray(counts, dtype=np.float64)
+    ncat, nbins = counts.shape
+    x.setBins(nbins)
+    data = RooDataHist(name, name, RooArgSet(x, cat))
+    fillDataHist(data, x, cat, ncat, nbins, counts)
+    return data
+#------------------------------------------------------------------
+# fit each diphoton category with its own background model and
+# yields, sharing the signal mass and width, using a RooSimultaneous
+# over the diphoton category. The likelihood of each category is
+# computed in a separate process (up to ncpu processes, by default
+# one per core). parts is the result of split_by_category.
+def fitSimultaneous(wspace, data, parts, ncpu=0):
+    if ncpu <= 0:
+        import multiprocessing
+        ncpu = multiprocessing.cpu_count()
+
+    # categories without data have no model
+    labels = [x for x in sorted(parts.keys()) if parts[x].sumEntries() > 0]
+    components = []
+    for label in labels:
+        n = parts[label].sumEntries()
+        wspace.factory('b_%s[%f, 0.0, %f]' % (label, n, 2*n+10))
+        wspace.factory('s_%s[%f, 0.0, %f]' % (label, 0.01*n, n))
+        wspace.factory('a1_%s[ 5.0, -50, 50]' % label)
+        wspace.factory('a2_%s[-1.0, -50, 50]' % label)
+        wspace.factory('expr::f_%s("-(a1_%s*(x/100)+a2_%s*(x/100)^2)",'\
+                       'a1_%s,a2_%s,x)' % ((label,)*5))
+        wspace.factory('Exponential::bmodel_%s(f_%s, 1)' % (label, label))
+        wspace.factory('SUM::model_%s(b_%s*bmodel_%s, s_%s*smodel)' % \
+                       ((label,)*4))
+        components.append('%s=model_%s' % (label, label))
+    wspace.factory('SIMUL::simmodel(diphoton, %s)' % \
+                   ','.join(components))
+    simmodel = wspace.pdf('simmodel')
+
+    print "="*80
+    print "simultaneous fit: %d categories, %d processes" % \
+      (len(labels), min(ncpu, len(labels)))
+    print "="*80
+    swatch = TStopwatch()
+    swatch.Start()
+    # NumCPU strategy 2: split the likelihood by category
+    results = simmodel.fitTo(data,
+                             RooFit.NumCPU(ncpu, 2),
+                             RooFit.Save(),
+                             RooFit.PrintLevel(-1))
+    print "real time: %10.3f s" % swatch.RealTime()
+
+    vmass = wspace.var('mass')
+    vwidth= wspace.var('w')
+    print "mass:       %10.1f +\-%-4.1f GeV" % (vmass.getVal(),
+                                               vmass.getError())
+    print "width:      %10.1f +\-%-4.1f GeV" % (vwidth.getVal(),
+                                               vwidth.getError())
+    for label in labels:
+        vsig = wspace.var('s_%s' % label)
+        print "signal(%s): %10.1f +\-%-5.1f" % (label,
+                                                vsig.getVal(),
+                                                vsig.getError())
+    return results
+#------------------------------------------------------------------
+# fit the same model as main() to the summed counts with the NumPy
+# likelihood of hggnll.py, which provides an analytic gradient to
+# the minimiser. As with fitTo, the densities are evaluated at the
+# bin centres (integrate=False).
+def fitAnalytic(wspace, mmin, mmax, counts):
+    from hggnll import BinnedNLL, PARAMETERS
+    n = counts.sum(axis=0)
+    step = (mmax-mmin)/len(n)
+    x = mmin + (np.arange(len(n))+0.5)*step
+    nll = BinnedNLL(x, n, integrate=False)
+
+    # the results of fitTo, for comparison
+    fitto = [(wspace.var(name).getVal(), wspace.var(name).getError())
+             for name in PARAMETERS]
+
+    start  = [n.sum(), 100, 5.0, -1.0, 125, 1.0]
+    bounds = [(wspace.var(name).getMin(), wspace.var(name).getMax())
+              for name in PARAMETERS]
+    print "="*80
+    print "fit model to data using an analytic gradient"
+    print "="*80
+    swatch = TStopwatch()
+    swatch.Start()
+    values, errors, value = nll.fit(start, bounds)
+    print "real time: %10.3f s  (%d calls)" % (swatch.RealTime(),
+                                               nll.ncalls)
+    print "%-11s %20s %20s" % ('', 'analytic', 'fitTo')
+    for name, v, e, (vf, ef) in zip(PARAMETERS, values, errors, fitto):
+        print "%-11s %10.1f +\-%-7.1f %10.1f +\-%-7.1f" % \
+          (name+':', v, e, vf, ef)
+    return (values, errors)
 #------------------------------------------------------------------    
 def main():
     # set up standard graphics style (see python/histutil.py)
@@ -78,16 +195,16 @@ def main():
     #----------------------------------------
     # read 7 TeV data into histograms
     #----------------------------------------
-    data7TeV = Table('hgg_7TeV.txt')
-    h7 = makeHistograms(data7TeV, 'h7_')
+    t7 = readTable('hgg_7TeV.txt')
+    h7 = makeHistograms(t7, 'h7_')
     c7 = plotHistograms(h7, 'fig_hgg_7TeV', '7 TeV')
     c7.SaveAs('.png')
     
     #----------------------------------------
     # read 8 TeV data into histograms
     #----------------------------------------
-    data8TeV = Table('hgg_8TeV.txt')
-    h8 = makeHistograms(data8TeV, 'h8_')
+    t8 = readTable('hgg_8TeV.txt')
+    h8 = makeHistograms(t8, 'h8_')
     c8 = plotHistograms(h8, 'fig_hgg_8TeV', '8 TeV', 200)
     c8.SaveAs('.png')
     
@@ -121,58 +238,43 @@ def main():
     
     #----------------------------------------
     # define di-photon categories and create
-    # a binned dataset from the Root
-    # histograms identified by a RooFit
-    # category
+    # a binned dataset from the tables of
+    # counts, one row per RooFit category
     #----------------------------------------
-    hmap = makeHmap()
-    
     # create categories
     cat  = RooCategory('diphoton',  'diphoton')
-    for h in h7:
-        name = h.GetName()
-        cat.defineType(name)
-        hmap.add(name, h)
-
-    for h in h8:
-        name = h.GetName()
-        cat.defineType(name)
-        hmap.add(name, h)
-
-    # create binned dataset from histograms.
-    # each histogram in hmap is associated with a diphoton
+    for h in h7 + h8:
+        cat.defineType(h.GetName())
+
+    # create binned dataset from the counts.
+    # each row of counts is associated with a diphoton
     # category.
-    data = RooDataHist('data', 'data', RooArgList(obs), cat, hmap())
+    data = makeDataHist('data', wspace.var('x'), cat,
+                        np.vstack((t7[-1], t8[-1])))
     
     # add data to workspace.
     # the RooCmdArg() is a workaround a PyROOT "feature"
     getattr(wspace,'import')(data, RooCmdArg())
 
     #----------------------------------------
-    # create summed data for 7 and 8 TeV
-    # separately. specify what is to be
-    # used the
-    # syntax:
-    #    diphoton==diphoton::<category1>
-    # ORed together
+    # split the data by diphoton category in
+    # one pass and create summed data for
+    # 7 and 8 TeV separately. specify the
+    # categories of each sum with patterns
+    # of category names
     #----------------------------------------
+    parts, sums = split_by_category(data, cat,
+                                    {'7TeV': 'h7_*', '8TeV': 'h8_*'})
     # 7 TeV data sum
-    cmd = joinfields(map(lambda i: 'diphoton==diphoton::h7_c%2.2d' % i,
-                         range(len(h7))), '||')
-    datasum7 = data.reduce(cmd)
+    datasum7 = sums['7TeV']
     datasum7.Print()
     ndata7 = int(datasum7.sumEntries())
 
     # 8 TeV data sum
-    cmd = joinfields(map(lambda i: 'diphoton==diphoton::h8_c%2.2d' % i,
-                         range(len(h8))), '||')
-    datasum8 = data.reduce(cmd)
+    datasum8 = sums['8TeV']
     datasum8.Print()
     ndata8 = int(datasum8.sumEntries())
 
-    # 7 + 8 TeV data sum
-    datasum = data.reduce('diphoton')
-    
     ndata   = ndata7 + ndata8
     ndatamax= ndata / 100000
     ndatamax= (ndatamax+1)*100000
@@ -277,6 +379,24 @@ def main():
     xframe.SetMaximum(8000)
     xframe.Draw()
     c1.SaveAs('.png')
+
+    #----------------------------------------
+    # optionally, repeat the fit with an
+    # analytic gradient and/or fit the
+    # categories simultaneously:
+    #   python exercise_4.py [--analytic]
+    #                        [--simultaneous [ncpu]]
+    #----------------------------------------
+    argv = sys.argv[1:]
+    if '--analytic' in argv:
+        fitAnalytic(wspace, t8[0], t8[1], np.vstack((t7[-1], t8[-1])))
+
+    if '--simultaneous' in argv:
+        ii = argv.index('--simultaneous')
+        ncpu = 0
+        if ii+1 < len(argv) and argv[ii+1].isdigit():
+            ncpu = int(argv[ii+1])
+        fitSimultaneous(wspace, data, parts, ncpu)
     
     sleep(5)
 #------------------------------------------------------------------
@@ -0,0 +1,185 @@
+//-----------------------------------------------------------------------------
+// File: RooDistanceModulus
+// Description: Compiled RooAbsReal for the distance modulus
+//              mu(z | OM, OL, H) of distanceModulus.cc. Unlike a
+//              RooFormulaVar it supports RooFit's batch evaluation, so
+//              the whole data set is computed in one call per parameter
+//              point (see distanceModulusBatch). The batch interface
+//              depends on the Root version:
+//                6.20 - 6.22  evaluateBatch(begin, maxSize)
+//                6.24 - 6.26  evaluateSpan
+//                6.28 - 6.30  computeBatch
+//                6.32 -       doEval
+//              Before 6.32, fitTo uses it only with RooFit.BatchMode(true).
+//
+//              Compile (once) and load with histutil.buildLibrary:
+//                buildLibrary('RooDistanceModulus.cxx')
+//              which also makes the functions of distanceModulus.cc
+//              available.
+//-----------------------------------------------------------------------------
+#ifndef ROODISTANCEMODULUS_CXX
+#define ROODISTANCEMODULUS_CXX
+#include <vector>
+#include "RVersion.h"
+#include "RooAbsReal.h"
+#include "RooRealProxy.h"
+#if ROOT_VERSION_CODE >= ROOT_VERSION(6,32,0)
+#include "RooFit/EvalContext.h"
+#elif ROOT_VERSION_CODE >= ROOT_VERSION(6,28,0)
+#include "RooFit/Detail/DataMap.h"
+#elif ROOT_VERSION_CODE >= ROOT_VERSION(6,24,0)
+#include "RunContext.h"
+#endif
+#include "distanceModulus.cc"
+//-----------------------------------------------------------------------------
+class RooDistanceModulus : public RooAbsReal
+{
+public:
+  RooDistanceModulus() {}
+  RooDistanceModulus(const char* name, const char* title,
+                     RooAbsReal& z,
+                     RooAbsReal& OM,
+                     RooAbsReal& OL,
+                     RooAbsReal& H)
+    : RooAbsReal(name, title),
+      _z("z", "redshift", this, z),
+      _OM("OM", "Omega_M", this, OM),
+      _OL("OL", "Omega_Lambda", this, OL),
+      _H("H", "Hubble constant", this, H)
+  {}
+
+  RooDistanceModulus(const RooDistanceModulus& other, const char* name=0)
+    : RooAbsReal(other, name),
+      _z("z", this, other._z),
+      _OM("OM", this, other._OM),
+      _OL("OL", this, other._OL),
+      _H("H", this, other._H)
+  {}
+
+  TObject* clone(const char* newname) const override
+  {
+    return new RooDistanceModulus(*this, newname);
+  }
+
+protected:
+  RooRealProxy _z;
+  RooRealProxy _OM;
+  RooRealProxy _OL;
+  RooRealProxy _H;
+
+  double evaluate() const override
+  {
+    return distanceModulus(_z, _OM, _OL, _H);
+  }
+
+  // z has one value per event; the parameters have either one value or
+  // one per event
+  void computeDistanceModuli(double* output, size_t n,
+                             const double* z, size_t nz,
+                             const double* OM, size_t nOM,
+                             const double* OL, size_t nOL,
+                             const double* H,  size_t nH) const
+  {
+    if ( nz == n && nOM == 1 && nOL == 1 && nH == 1 )
+      {
+        distanceModulusBatch((int)n, z, OM[0], OL[0], H[0], output);
+        return;
+      }
+    for(size_t i=0; i < n; i++)
+      output[i] = distanceModulus(z[nz > 1 ? i : 0],
+                                  OM[nOM > 1 ? i : 0],
+                                  OL[nOL > 1 ? i : 0],
+                                  H[nH > 1 ? i : 0]);
+  }
+
+#if ROOT_VERSION_CODE >= ROOT_VERSION(6,32,0)
+  void doEval(RooFit::EvalContext& ctx) const override
+  {
+    auto z  = ctx.at(_z);
+    auto OM = ctx.at(_OM);
+    auto OL = ctx.at(_OL);
+    auto H  = ctx.at(_H);
+    auto output = ctx.output();
+    computeDistanceModuli(output.data(), output.size(),
+                          z.data(),  z.size(),
+                          OM.data(), OM.size(),
+                          OL.data(), OL.size(),
+                          H.data(),  H.size());
+  }
+#elif ROOT_VERSION_CODE >= ROOT_VERSION(6,30,0)
+  void computeBatch(double* output, size_t n,
+                    RooFit::Detail::DataMap const& dataMap) const override
+  {
+    auto z  = dataMap.at(_z);
+    auto OM = dataMap.at(_OM);
+    auto OL = dataMap.at(_OL);
+    auto H  = dataMap.at(_H);
+    computeDistanceModuli(output, n,
+                          z.data(),  z.size(),
+                          OM.data(), OM.size(),
+                          OL.data(), OL.size(),
+                          H.data(),  H.size());
+  }
+#elif ROOT_VERSION_CODE >= ROOT_VERSION(6,28,0)
+  void computeBatch(cudaStream_t*, double* output, size_t n,
+                    RooFit::Detail::DataMap const& dataMap) const override
+  {
+    auto z  = dataMap.at(_z);
+    auto OM = dataMap.at(_OM);
+    auto OL = dataMap.at(_OL);
+    auto H  = dataMap.at(_H);
+    computeDistanceModuli(output, n,
+                          z.data(),  z.size(),
+                          OM.data(), OM.size(),
+                          OL.data(), OL.size(),
+                          H.data(),  H.size());
+  }
+#elif ROOT_VERSION_CODE >= ROOT_VERSION(6,24,0)
+  RooSpan<double> evaluateSpan(RooBatchCompute::RunContext& evalData,
+                               const RooArgSet* normSet) const override
+  {
+    auto z  = _z.arg().getValues(evalData, normSet);
+    auto OM = _OM.arg().getValues(evalData, normSet);
+    auto OL = _OL.arg().getValues(evalData, normSet);
+    auto H  = _H.arg().getValues(evalData, normSet);
+    size_t n = z.size();
+    auto output = evalData.makeBatch(this, n);
+    computeDistanceModuli(output.data(), n,
+                          z.data(),  z.size(),
+                          OM.data(), OM.size(),
+                          OL.data(), OL.size(),
+                          H.data(),  H.size());
+    return output;
+  }
+#elif ROOT_VERSION_CODE >= ROOT_VERSION(6,20,0)
+  RooSpan<double> evaluateBatch(std::size_t begin,
+                                std::size_t maxSize) const override
+  {
+    auto z = _z.arg().getValBatch(begin, maxSize);
+    if ( z.empty() ) return {};
+
+    // parameters without batch data are constant over the batch
+    double OMval = _OM;
+    double OLval = _OL;
+    double Hval  = _H;
+    auto OM = _OM.arg().getValBatch(begin, maxSize);
+    auto OL = _OL.arg().getValBatch(begin, maxSize);
+    auto H  = _H.arg().getValBatch(begin, maxSize);
+
+    size_t n = z.size();
+    auto output = _batchData.makeWritableBatchUnInit(begin, n);
+    computeDistanceModuli(output.data(), n,
+                          z.data(), n,
+                          OM.empty() ? &OMval : OM.data(),
+                          OM.empty() ? 1 : OM.size(),
+                          OL.empty() ? &OLval : OL.data(),
+                          OL.empty() ? 1 : OL.size(),
+                          H.empty()  ? &Hval  : H.data(),
+                          H.empty()  ? 1 : H.size());
+    return output;
+  }
+#endif
+
+  ClassDefOverride(RooDistanceModulus, 1)
+};
+#endif
@@ -0,0 +1,96 @@
+#-----------------------------------------------------------------------------
+# File: cosmology.py
+# Description: NumPy versions of the functions in distanceModulus.cc.
+#              They operate on whole arrays: distanceModulus accepts an
+#              array of redshifts and scalar or array parameters, so that
+#              the model for all the data, or for a grid of (OM, OL)
+#              points, is computed in one call.
+#
+#              OM   - Omega_M
+#              OL   - Omega_Lambda
+#              H    - related to Hubble's constant
+#-----------------------------------------------------------------------------
+from __future__ import absolute_import
+from __future__ import print_function
+import numpy as np
+#-----------------------------------------------------------------------------
+OFFSET = 5*np.log10(2.99e5) + 25
+#-----------------------------------------------------------------------------
+# Lambda CDM model
+def LCDMModel(a, OM, OL):
+    # a^3 * [Omega_M/a^3 + (1-Omega_M-Omega_L)/a^2 + Omega_L]
+    y = OM + (1 - OM - OL)*a + OL*a*a*a
+    return np.where(y > 0, y, 1.e50)
+
+# pick model
+model = LCDMModel
+
+# parameters as arrays with a trailing axis of length 1, so that they
+# broadcast against arrays of redshifts or scale factors
+def parameters(*args):
+    return [np.asarray(x, dtype=np.float64)[..., np.newaxis] for x in args]
+
+# compute distance modulus for redshifts z. The integral is tabulated
+# cumulatively on one grid of nsteps midpoint steps covering all z, then
+# completed with the partial step between each a = 1/(1+z) and the grid
+# point above it, as in distanceModulus.cc (the result for z < 0 is NaN).
+# The grid step depends on the largest z, so results can differ slightly
+# (a few parts in 10^8) with the other redshifts of the call. If the
+# parameters are arrays (of the same shape) the result has shape
+# OM.shape + z.shape.
+def distanceModulus(z, OM, OL, H, nsteps=2000):
+    z = np.asarray(z, dtype=np.float64)
+    shape = np.broadcast(OM, OL, H).shape + z.shape
+    OM, OL, H = parameters(OM, OL, H)
+    zz = z.ravel()
+
+    amin = 1.0/(1 + max(zz.max(), 2.0))
+    h = (1 - amin) / nsteps
+    x = 1 - (np.arange(nsteps) + 0.5)*h
+    F = np.cumsum(h/np.sqrt(x * model(x, OM, OL)), axis=-1)
+    F = np.concatenate((np.zeros(F.shape[:-1] + (1,)), F), axis=-1)
+
+    a  = 1.0/(1 + zz)
+    k  = np.clip((1 - a) / h, 0, nsteps).astype(np.int64)
+    xk = 1 - k*h
+    xm = 0.5*(xk + a)
+    F  = F[..., k] + np.where(xk != a,
+                              (xk - a)/np.sqrt(xm * model(xm, OM, OL)), 0)
+
+    OK = 1 - OM - OL
+    rootOK = np.sqrt(np.where(OK != 0, np.abs(OK), 1))
+    theta  = rootOK * F
+    F = np.where(OK > 0, np.sinh(theta)/rootOK,
+                 np.where(OK < 0, np.sin(theta)/rootOK, F))
+
+    y = 5*np.log10((1 + zz)*F/H) + OFFSET
+    return y.reshape(shape)
+
+# chi^2 of the observed distance moduli x +/- dx at redshifts z
+# (one value per parameter point)
+def chi2(z, x, dx, OM, OL, H):
+    c = (np.asarray(x) - distanceModulus(z, OM, OL, H))/np.asarray(dx)
+    return (c*c).sum(axis=-1)
+
+# N scale factors a and the midpoints x of the integration steps
+def grid(amax, N):
+    h = float(amax) / N
+    x = (np.arange(N) + 0.5)*h
+    return (h, x, x + 0.5*h)
+
+# compute lifetime vs a; returns (t, a)
+def scaleFactor(amax, OM, OL, N):
+    h, x, a = grid(amax, N)
+    t = np.cumsum(np.sqrt(x / model(x, OM, OL)))*h
+    return (t, a)
+
+# compute comoving distance vs. a; returns (chi, a)
+def comovingDistance(amax, OM, OL, N):
+    h, x, a = grid(amax, N)
+    chi = np.cumsum(1.0 / np.sqrt(x * model(x, OM, OL)))*h
+    return (chi, a)
+
+# compute Omega(a); returns (a, O)
+def Omega(amax, OM, OL, N):
+    h, x, a = grid(amax, N)
+    return (a, model(a, OM, OL)/a**3)
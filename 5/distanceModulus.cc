@@ -13,6 +13,8 @@
 // Updated for ESHEP 2012, La Pommeraye, Anjou, France
 // Updated for CMSDAS 2016 LPC, Fermilab
 //-----------------------------------------------------------------------------
+#ifndef DISTANCEMODULUS_CC
+#define DISTANCEMODULUS_CC
 #include <cmath>
 #include <cassert>
 #include <iostream>
@@ -42,21 +44,11 @@ double LCDMModel(double a, double OM, double OL)
 // pick model
 double (*model)(double, double, double) = LCDMModel;
 
-// compute distance modulus
-double distanceModulus(double z, double OM, double OL, double H)
+// convert the integral F = int_a^1 dx / sqrt(x * model(x)) to the
+// distance modulus
+double distanceModulusFromIntegral(double z, double F, 
+                                   double OM, double OL, double H)
 {
-  int N=200;
-  double F = 0;
-  double a = 1.0/(1+z);
-  double h = (1-a) / N;
-  
-  for(int i=0; i < N; i++)
-    {
-      double x = a + (i+0.5)*h;
-      F = F + 1.0/sqrt(x * model(x, OM, OL));
-    }
-
-  F = F*h;
   double OK = 1 - OM - OL;
 
   if ( OK != 0 )
@@ -74,6 +66,104 @@ double distanceModulus(double z, double OM, double OL, double H)
   return y;
 }
 
+// compute distance modulus with a fresh 200-step midpoint integral
+// (the original algorithm, kept for comparison)
+double distanceModulusDirect(double z, double OM, double OL, double H)
+{
+  int N=200;
+  double F = 0;
+  double a = 1.0/(1+z);
+  double h = (1-a) / N;
+  
+  for(int i=0; i < N; i++)
+    {
+      double x = a + (i+0.5)*h;
+      F = F + 1.0/sqrt(x * model(x, OM, OL));
+    }
+
+  F = F*h;
+  return distanceModulusFromIntegral(z, F, OM, OL, H);
+}
+
+// Cumulative midpoint integral of 1/sqrt(x * model(x)) from 1 down to
+// a on a single grid x_k = 1 - k*h, k = 0...DM_NSTEPS, covering
+// 0 <= z <= zmax. The grid depends only on (model, OM, OL), so it is
+// computed once per parameter point and reused for every redshift;
+// H enters only through distanceModulusFromIntegral. The grid is
+// rebuilt, with a larger step, when a redshift above zmax is requested,
+// so a result can change slightly (a few parts in 10^8) with the
+// redshifts of earlier calls.
+const int DM_NSTEPS = 2000;
+struct DMGrid
+{
+  double (*model)(double, double, double);
+  double OM;
+  double OL;
+  double zmax;
+  double h;
+  double F[DM_NSTEPS+1];
+};
+DMGrid dmgrid = {0, 0, 0, 0, 0, {0}};
+
+const DMGrid& distanceModulusGrid(double z, double OM, double OL)
+{
+  DMGrid& g = dmgrid;
+  if ( g.model == model && g.OM == OM && g.OL == OL && z <= g.zmax )
+    return g;
+
+  double zmax = z > 2 ? z : 2;
+  if ( g.model == model && g.OM == OM && g.OL == OL && zmax < 2*g.zmax )
+    zmax = 2*g.zmax;
+  double amin = 1.0/(1+zmax);
+
+  g.model = model;
+  g.OM    = OM;
+  g.OL    = OL;
+  g.zmax  = zmax;
+  g.h     = (1-amin) / DM_NSTEPS;
+  g.F[0]  = 0;
+  for(int k=0; k < DM_NSTEPS; k++)
+    {
+      double x = 1 - (k+0.5)*g.h;
+      g.F[k+1] = g.F[k] + g.h/sqrt(x * model(x, OM, OL));
+    }
+  return g;
+}
+
+// compute distance modulus using the cached grid: the integral up to
+// the nearest grid point at or above a, plus the remaining partial step.
+// For z < 0 (a > 1) the partial step from x = 1 is negative, and so is
+// the result undefined (NaN), as with distanceModulusDirect.
+double distanceModulus(double z, double OM, double OL, double H)
+{
+  const DMGrid& g = distanceModulusGrid(z, OM, OL);
+  double a = 1.0/(1+z);
+  double u = (1-a) / g.h;
+  int k = u > 0 ? (u < DM_NSTEPS ? (int)u : DM_NSTEPS) : 0;
+  double xk = 1 - k*g.h;
+  double F  = g.F[k];
+  if ( xk != a )
+    {
+      double x = 0.5*(xk + a);
+      F = F + (xk - a)/sqrt(x * model(x, OM, OL));
+    }
+  return distanceModulusFromIntegral(z, F, OM, OL, H);
+}
+
+// compute the distance modulus for n redshifts at once; the grid is
+// built (at most) once, for the largest redshift
+void distanceModulusBatch(int n, const double* z, 
+                          double OM, double OL, double H, double* mu)
+{
+  double zmax = 0;
+  for(int i=0; i < n; i++)
+    if ( z[i] > zmax ) zmax = z[i];
+  distanceModulusGrid(zmax, OM, OL);
+
+  for(int i=0; i < n; i++)
+    mu[i] = distanceModulus(z[i], OM, OL, H);
+}
+
 // compute lifetime vs a
 void scaleFactor(double amax, double OM, double OL, 
                  int N, double* t, double* a)
@@ -116,4 +206,4 @@ void Omega(double amax, double OM, double OL,
       O[i] = model(a[i], OM, OL)/pow(a[i], 3);
     }
 }
-
+#endif
@@ -9,6 +9,8 @@ import os,sys          # operating system, system modules
 from histutil import * # load some utilities built on PyRoot
 from time import sleep # well...kind of obvious, no?
 from ROOT import *     # load all of PyROOT
+import numpy as np     # arrays
+import cosmology       # NumPy version of distanceModulus.cc
 #------------------------------------------------------------------
 # procedure to make nice plots
 def makePlots(data, OM, OL, H, zmin, zmax, mumin, mumax, tmax, amax, NP):
@@ -18,24 +20,10 @@ def makePlots(data, OM, OL, H, zmin, zmax, mumin, mumax, tmax, amax, NP):
     q = H.getVal()
 
     # Copy data into arrays
-    xx = array('d')
-    ex = array('d')
-    yy = array('d')
-    ey = array('d')
-
-    chi2 = 0.0
-    ndata = data.numEntries()
-    for ii in xrange(ndata):
-        row = data.get(ii)
-        xx.append(row['z'].getVal())
-        ex.append(0)
-        yy.append(row['x'].getVal())
-        ey.append(row['dx'].getVal())
-        mu = distanceModulus(xx[-1],
-                     omegaM,
-                     omegaL, q)
-        c = (yy[-1]-mu)/ey[-1]
-        chi2 += c*c
+    xx, yy, ey = datasetcolumns(data, ['z', 'x', 'dx'])
+    ex = np.zeros(len(xx))
+    ndata = len(xx)
+    chi2 = cosmology.chi2(xx, yy, ey, omegaM, omegaL, q)
 
     gd = mkgraphErrors(xx, yy, ex, ey,
                "redshift z",
@@ -49,13 +37,8 @@ def makePlots(data, OM, OL, H, zmin, zmax, mumin, mumax, tmax, amax, NP):
     # Create model plot
     nz = 200
     zstep = (zmax-zmin)/nz
-    zz = array('d')
-    mu = array('d')
-    for ii in xrange(nz):
-        zz.append( (ii+0.5)*zstep )
-        mu.append( distanceModulus(zz[-1],
-                       omegaM,
-                       omegaL, q) )
+    zz = (np.arange(nz)+0.5)*zstep
+    mu = cosmology.distanceModulus(zz, omegaM, omegaL, q)
 
     gm = mkgraph(zz, mu,
              "redshift z", "distance modulus #mu", 
@@ -63,26 +46,15 @@ def makePlots(data, OM, OL, H, zmin, zmax, mumin, mumax, tmax, amax, NP):
     gm.SetName('model')
 
     # Create a vs H0 t plot
-    np = 500
-    a = array('d')
-    t = array('d')
-
-    for ii in xrange(np):
-        a.append(0)
-        t.append(0)
-
-    scaleFactor(amax, omegaM, omegaL, np, t, a)
+    npoints = 500
+    t, a = cosmology.scaleFactor(amax, omegaM, omegaL, npoints)
     ga = mkgraph(t, a,
              "t/T_{0}", "a(t)", 
              0, tmax, color=kBlue, lwidth=2)
     ga.SetName('scaleFactor')
 
     # Create Omega vs a plot
-    O = array('d')
-    for ii in xrange(np):
-        O.append(0)
-
-    Omega(amax, omegaM, omegaL, np, a, O)
+    a, O = cosmology.Omega(amax, omegaM, omegaL, npoints)
     gO = mkgraph(a, O,
              "a", "#Omega(a)", 
              0, amax, color=kBlue, lwidth=2)
@@ -107,9 +79,9 @@ def main():
     print "\t\tType Ia Supernovae"
     print "="*80
 
-    # compile distance modulus function and import into Python
-    gROOT.ProcessLine(open('distanceModulus.cc').read())
-    from ROOT import distanceModulus
+    # compile distance modulus function and RooDistanceModulus class
+    # (once; later runs load the library)
+    buildLibrary('RooDistanceModulus.cxx')
     
     # make a workspace so that we can use its factory method
     wspace = RooWorkspace('TypeIa')
@@ -157,13 +129,14 @@ def main():
     H = wspace.var('H')
 
     # create distance modulus parameter 
-    # note use of compiled C++ program
-    mu = RooFormulaVar('mu', '#mu',
-                       'distanceModulus(z, OM, OL, H)',
-                       RooArgList(z, OM, OL, H))
+    # note use of compiled C++ class, which RooFit can evaluate for
+    # all the data in one call (see RooDistanceModulus.cxx)
+    mu = RooDistanceModulus('mu', '#mu', z, OM, OL, H)
     # import mu into workspace so the latter "knows" about it
-    # (last argument is a workaround a PyROOT bug)
+    # (last argument is a workaround a PyROOT bug), together with
+    # its source code so that the workspace can be persisted
     getattr(wspace,'import')(mu, RooCmdArg())
+    wspace.importClassCode(RooDistanceModulus.Class())
 
     # create model to be fitted
     wspace.factory('Gaussian::model(x, mu, dx)')
@@ -199,7 +172,13 @@ def main():
     swatch = TStopwatch()
     swatch.Start()
 
-    results = model.fitTo(data, RooFit.Save())
+    # before Root 6.32, RooFit evaluates the model event by event (and
+    # never calls the batch code of RooDistanceModulus) unless batch mode
+    # is requested
+    if gROOT.GetVersionCode() < 63200:
+        results = model.fitTo(data, RooFit.Save(), RooFit.BatchMode(True))
+    else:
+        results = model.fitTo(data, RooFit.Save())
     print "real time: %10.3f s" % swatch.RealTime()
     print "="*80
     results.Print()
@@ -0,0 +1,74 @@
+#!/usr/bin/env python
+#-----------------------------------------------------------------------------
+# Benchmark histutil.BDT: per-event Node walk vs flattened batch evaluation
+# usage: python bench_bdt.py [ntrees] [nevents] [depth]
+#-----------------------------------------------------------------------------
+from __future__ import print_function
+import os, sys, time, tempfile
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+import numpy as np
+from histutil import BDT, cachename
+#-----------------------------------------------------------------------------
+NVARS = 4
+
+# write a random tree in the format of the NN(...) constructors of a
+# TMVA BDT class file: NN(left, right, selector, cutValue, cutType,
+# nodeType, purity, response)
+def makeNode(rng, depth):
+    if depth == 0 or rng.uniform() < 0.1:
+        nodeType = 1 if rng.uniform() < 0.5 else -1
+        return 'NN(\n0, \n0, \n-1, 0, 1, %d, %.6f,-99) ' % \
+          (nodeType, rng.uniform())
+    return 'NN(\n%s, \n%s, \n%d, %.9e, %d, 0, %.6f,-99) ' % \
+      (makeNode(rng, depth-1), makeNode(rng, depth-1),
+       rng.randint(NVARS), rng.normal(), rng.randint(2), rng.uniform())
+
+def makeWeights(filename, ntrees, depth):
+    rng = np.random.RandomState(314159)
+    out = open(filename, 'w')
+    out.write('void ReadBDT::Initialize()\n{\n')
+    for itree in range(ntrees):
+        out.write('  // itree = %d\n' % itree)
+        out.write('  fBoostWeights.push_back(%.9f);\n' % rng.uniform(0.1, 1))
+        out.write('  fForest.push_back( \n%s   );\n' % makeNode(rng, depth))
+    out.write('   return;\n};\n')
+    out.close()
+
+def main():
+    argv    = sys.argv[1:]
+    ntrees  = int(argv[0]) if len(argv) > 0 else 400
+    nevents = int(argv[1]) if len(argv) > 1 else 20000
+    depth   = int(argv[2]) if len(argv) > 2 else 4
+
+    filename = os.path.join(tempfile.mkdtemp(), 'bench_bdt.class.C')
+    makeWeights(filename, ntrees, depth)
+
+    t = time.time()
+    bdt = BDT(filename)
+    t = time.time() - t
+    print("parse:     %10.3f s  (%d trees)" % (t, len(bdt.weights)))
+
+    t = time.time()
+    bdt = BDT(filename)
+    t = time.time() - t
+    print("cached:    %10.3f s" % t)
+
+    x = np.random.RandomState(2718).normal(size=(nevents, NVARS))
+
+    t = time.time()
+    slow = [bdt(list(event)) for event in x]
+    tslow = time.time() - t
+
+    t = time.time()
+    fast = bdt.evaluate(x)
+    tfast = time.time() - t
+
+    print("per-event: %10.3f s  (%d events)" % (tslow, nevents))
+    print("batch:     %10.3f s  speed-up: %6.1f" % (tfast, tslow/tfast))
+    print("identical: %s" % (np.array(slow) == fast).all())
+    for name in [filename, cachename(filename) + '.npz']:
+        if os.path.exists(name): os.remove(name)
+    os.rmdir(os.path.dirname(filename))
+#-----------------------------------------------------------------------------
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,77 @@
+#!/usr/bin/env python
+#-----------------------------------------------------------------------------
+# Benchmark the Type Ia supernova fit of exercise 5: distanceModulusDirect
+# (a fresh 200-step integral per call) vs distanceModulus (one cumulative
+# integral per parameter point, cached across calls) vs RooDistanceModulus
+# (the compiled class, evaluated in batch mode)
+# usage: python bench_distance.py [repeat]
+#-----------------------------------------------------------------------------
+from __future__ import print_function
+import os, sys, time
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+import ROOT as rt
+from histutil import buildLibrary
+#-----------------------------------------------------------------------------
+EXERCISE = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                        '..', '..', '5')
+
+# before Root 6.32 batch evaluation must be requested
+BATCHMODE = rt.gROOT.GetVersionCode() < 63200
+
+def makeModel(func):
+    wspace = rt.RooWorkspace('TypeIa_%s' % func)
+    wspace.factory('z[0, 1.5]')
+    wspace.factory('x[32, 48]')
+    wspace.factory('dx[0, 2]')
+    wspace.factory('OM[0.5, 0, 200]')
+    wspace.factory('OL[0.5, 0, 200]')
+    wspace.factory('H[70, 0, 200]')
+    z, OM, OL, H = [wspace.var(x) for x in ['z', 'OM', 'OL', 'H']]
+    if func == 'RooDistanceModulus':
+        mu = rt.RooDistanceModulus('mu', '#mu', z, OM, OL, H)
+    else:
+        mu = rt.RooFormulaVar('mu', '#mu', '%s(z, OM, OL, H)' % func,
+                              rt.RooArgList(z, OM, OL, H))
+    getattr(wspace, 'import')(mu, rt.RooCmdArg())
+    wspace.factory('Gaussian::model(x, mu, dx)')
+    return wspace
+
+def main():
+    argv   = sys.argv[1:]
+    repeat = int(argv[0]) if len(argv) > 0 else 3
+
+    # also provides the functions of distanceModulus.cc
+    buildLibrary(os.path.join(EXERCISE, 'RooDistanceModulus.cxx'))
+    rt.RooMsgService.instance().setGlobalKillBelow(rt.RooFit.FATAL)
+
+    results = []
+    for func in ['distanceModulusDirect', 'distanceModulus',
+                 'RooDistanceModulus']:
+        wspace = makeModel(func)
+        name = rt.RooStringVar('name', 'TypeIa', 'name of type Ia')
+        data = rt.RooDataSet.read(os.path.join(EXERCISE, 'SCPUnion2.1.txt'),
+                                  rt.RooArgList(name, wspace.var('z'),
+                                                wspace.var('x'),
+                                                wspace.var('dx')))
+        best = None
+        for i in range(repeat):
+            for x in ['OM', 'OL', 'H']:
+                wspace.var(x).setVal(70 if x == 'H' else 0.5)
+            t = time.time()
+            if func == 'RooDistanceModulus' and BATCHMODE:
+                wspace.pdf('model').fitTo(data, rt.RooFit.PrintLevel(-1),
+                                          rt.RooFit.BatchMode(True))
+            else:
+                wspace.pdf('model').fitTo(data, rt.RooFit.PrintLevel(-1))
+            t = time.time() - t
+            if best == None or t < best: best = t
+        OM, OL = wspace.var('OM'), wspace.var('OL')
+        print("%-22s fit: %8.3f s  OM = %6.4f +/- %6.4f  OL = %6.4f +/- %6.4f"\
+              % (func, best, OM.getVal(), OM.getError(),
+                 OL.getVal(), OL.getError()))
+        results.append(best)
+    print("speed-up: %6.1f (distanceModulus)  %6.1f (RooDistanceModulus)"\
+          % (results[0]/results[1], results[0]/results[2]))
+#-----------------------------------------------------------------------------
+if __name__ == "__main__":
+    main()
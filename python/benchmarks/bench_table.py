@@ -0,0 +1,90 @@
+#!/usr/bin/env python
+#-----------------------------------------------------------------------------
+# Benchmark histutil.Table: columnar (NumPy) layout vs list-of-rows layout,
+# parsing the text file each time, and the columnar layout read from its
+# binary cache
+# usage: python bench_table.py [nrows] [ncategories]
+#-----------------------------------------------------------------------------
+from __future__ import print_function
+import os, sys, time, tempfile
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+import numpy as np
+from histutil import Table, cachename
+#-----------------------------------------------------------------------------
+def makeTable(filename, nrows, ncols):
+    # hgg_7TeV.txt-like table: a mass column followed by category counts
+    rng = np.random.RandomState(12345)
+    mass = 100.4 + 0.8*np.arange(nrows)
+    counts = rng.poisson(100, size=(nrows, ncols))
+    out = open(filename, 'w')
+    out.write(' mass' + ''.join(['  c%2.2d' % i for i in range(ncols)]) + '\n')
+    for m, row in zip(mass, counts):
+        out.write('%5.1f' % m + ''.join(['%5d' % c for c in row]) + '\n')
+    out.close()
+
+def memory(load):
+    try:
+        import tracemalloc
+    except ImportError:
+        return (load(), -1)
+    tracemalloc.start()
+    table = load()
+    size = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    return (table, size)
+
+def timeit(func, repeat=3):
+    best = None
+    for i in range(repeat):
+        t = time.time()
+        func()
+        t = time.time() - t
+        if best == None or t < best: best = t
+    return best
+
+def main():
+    argv  = sys.argv[1:]
+    nrows = int(argv[0]) if len(argv) > 0 else 200000
+    ncols = int(argv[1]) if len(argv) > 1 else 28
+
+    filename = os.path.join(tempfile.mkdtemp(), 'bench_table.txt')
+    makeTable(filename, nrows, ncols)
+    print("table: %d rows x %d columns (%5.1f MB)" % \
+          (nrows, ncols+1, os.path.getsize(filename)/1.e6))
+
+    print("%-12s %12s %12s %14s %14s" % \
+          ('layout', 'load (s)', 'memory (MB)', 'column (ms)', 'table[i][j] (s)'))
+    for layout, columnar, cache in [('rows',     False, False),
+                                    ('columnar', True,  False),
+                                    ('cached',   True,  True)]:
+        load  = lambda: Table(filename, columnar=columnar, cache=cache)
+        tload = timeit(load)
+        table, size = memory(load)
+
+        # sum one category column
+        def column():
+            c = table.column(ncols//2 + 1)
+            if columnar:
+                return c.sum()
+            return sum([c[i] for i in range(nrows)])
+        tcol = timeit(column)
+
+        # element access through rows, as in makeHistograms
+        def element():
+            total = 0.0
+            for i in range(nrows):
+                total += table[i][1]
+            return total
+        telem = timeit(element, 1)
+
+        print("%-12s %12.3f %12.1f %14.3f %14.3f" % \
+              (layout, tload, size/1.e6, 1000*tcol, telem))
+
+    for name in [filename,
+                 cachename(filename) + '.npy',
+                 cachename(filename) + '.json']:
+        if os.path.exists(name): os.remove(name)
+    os.rmdir(os.path.dirname(filename))
+#-----------------------------------------------------------------------------
+if __name__ == "__main__":
+    main()
@@ -8,7 +8,9 @@ import os, sys, re
 from glob import glob
 from array import array
 from math import sqrt, log
+import numpy as np
 import ROOT as rt
+from nphist import Hist1, Hist2
 #-----------------------------------------------------------------------------
 # Hack to suppress harmless warning
 # see: https://root.cern.ch/phpBB3/viewtopic.php?f=14&t=17682
@@ -282,15 +284,174 @@ def percentiles(points, percent):
         ps.append(c)
     return ps
 
+def percentilearray(points, percent):
+    # Vectorised version of percentiles(): points is an (npoints, nbins)
+    # array and the result an (len(percent), nbins) array. A single
+    # partial sort (np.partition) is done for all percentiles.
+    n = points.shape[0]
+    x = np.asarray(percent, dtype=np.float64) * n
+    k = np.minimum(x.astype(int), n-1)
+    f = (x - k)[:, np.newaxis]
+    k2= np.minimum(k+1, n-1)
+    pts = np.partition(points, np.unique(np.concatenate([k, k2])), axis=0)
+    c1 = pts[k]
+    c2 = pts[k2]
+    return np.where((k < n-1)[:, np.newaxis], c1*(1-f) + c2*f, c1)
+
+class QuantileSketch:
+    # Mergeable quantile sketch for curves (a KLL-style compactor
+    # hierarchy, vectorised over the points of the curve). Level h holds
+    # items of weight 2^h; when a level reaches k items it is sorted and
+    # every other item (from a random offset) is promoted to level h+1.
+    # Memory is O(k log2(n/k)) per point for n curves.
+    #
+    # Error bound: each compaction at level h shifts the rank of any value
+    # by at most 2^h, so the normalised rank error of a percentile is at
+    # most log2(n/k)/k; because the offsets are random the shifts cancel
+    # on average and the typical (rms) rank error is about 1.4/k,
+    # independent of n. E.g., k = 1024 gives ~0.15% in rank. Merging
+    # sketches gives the same bound in terms of the total n. Until k
+    # curves have been added the percentiles are exact.
+
+    def __init__(self, size, k=1024, seed=None):
+        self.size  = size
+        self.k     = max(2, 2*(k//2))
+        self.count = 0
+        self.n0    = 0
+        self.level0= np.empty((self.k, size), dtype=np.float64)
+        self.levels= [np.empty((0, size), dtype=np.float64)]
+        self.random= np.random.RandomState(seed)
+
+    def __del__(self):
+        pass
+
+    def add(self, y):
+        self.level0[self.n0] = y
+        self.n0 += 1
+        self.count += 1
+        if self.n0 == self.k:
+            self.n0 = 0
+            self.push(1, self.halve(self.level0))
+
+    def halve(self, items):
+        # sort each point's items and keep every other one
+        items = np.sort(items, axis=0)
+        return items[self.random.randint(2)::2]
+
+    def push(self, h, items):
+        # add items of weight 2^h, compacting every level that fills up
+        while True:
+            while len(self.levels) <= h:
+                self.levels.append(np.empty((0, self.size), dtype=np.float64))
+            level = np.concatenate([self.levels[h], items])
+            if len(level) < self.k:
+                self.levels[h] = level
+                return
+            m = len(level) - len(level) % 2
+            self.levels[h] = level[m:]
+            items = self.halve(level[:m])
+            h += 1
+
+    def merge(self, other):
+        if other.size != self.size or other.k != self.k:
+            print("*** QuantileSketch - ERROR*** cannot merge sketches")
+            print("size: %d, %d  k: %d, %d" % (self.size, other.size,
+                                              self.k, other.k))
+            return False
+        for y in other.level0[:other.n0]:
+            self.add(y)
+        for h in range(1, len(other.levels)):
+            if len(other.levels[h]) > 0:
+                self.push(h, other.levels[h])
+        self.count += other.count - other.n0
+        return True
+
+    def quantiles(self, percent):
+        # same interpolation as percentiles(), using weighted ranks
+        items = [self.level0[:self.n0]] + self.levels[1:]
+        values = np.concatenate(items)
+        weight = np.concatenate([np.full(len(x), 2**h, dtype=np.float64)
+                                 for h, x in enumerate(items)])
+        order  = np.argsort(values, axis=0)
+        column = np.arange(self.size)
+        values = values[order, column]
+        cumw   = np.cumsum(weight[order], axis=0)
+
+        n = self.count
+        z = np.empty((len(percent), self.size), dtype=np.float64)
+        for ii, p in enumerate(percent):
+            x = p * n
+            k = min(int(x), n-1)
+            f = x - k
+            c1 = values[(cumw <= k).sum(axis=0), column]
+            if k < n-1:
+                c2 = values[(cumw <= k+1).sum(axis=0), column]
+                z[ii] = c1*(1-f) + c2*f
+            else:
+                z[ii] = c1
+        return z
+
+    def save(self, filename):
+        store = {'size':   self.size,
+                 'k':      self.k,
+                 'count':  self.count,
+                 'level0': self.level0[:self.n0]}
+        for h in range(1, len(self.levels)):
+            store['level%d' % h] = self.levels[h]
+        np.savez(filename, **store)
+
+    @staticmethod
+    def load(filename):
+        store = np.load(filename)
+        sketch = QuantileSketch(int(store['size']), int(store['k']))
+        level0 = store['level0']
+        sketch.n0 = len(level0)
+        sketch.level0[:sketch.n0] = level0
+        h = 1
+        while 'level%d' % h in store.files:
+            sketch.levels.append(store['level%d' % h])
+            h += 1
+        sketch.count = int(store['count'])
+        return sketch
+
 class PercentileCurve:
 
-    def __init__(self, size):
+    # If sketch > 0, keep a QuantileSketch with k = sketch instead of
+    # every curve: memory no longer grows with the number of curves and
+    # the percentiles are approximate (see QuantileSketch for the bound).
+    def __init__(self, size, capacity=1024, sketch=0):
         self.size = size
-        self.points = [[] for x in size*[0]]
+        self.ntoys = 0
+        if sketch > 0:
+            self.sketch = QuantileSketch(size, sketch)
+            self.buffer = None
+        else:
+            self.sketch = None
+            # (ntoys x nbins) buffer, doubled in size whenever it is full
+            self.buffer = np.empty((max(1, capacity), size), dtype=np.float64)
 
     def __del__(self):
         pass
 
+    # points[ii] are the values of all curves at point ii
+    @property
+    def points(self):
+        if self.sketch != None: return None
+        return self.buffer[:self.ntoys].T
+
+    def append(self, y):
+        if self.sketch != None:
+            self.sketch.add(y)
+            self.ntoys += 1
+            return
+        if self.ntoys >= self.buffer.shape[0]:
+            buffer = np.empty((2*self.buffer.shape[0], self.size),
+                              dtype=np.float64)
+            buffer[:self.ntoys] = self.buffer[:self.ntoys]
+            self.buffer = buffer
+        self.buffer[self.ntoys] = y
+        self.ntoys += 1
+
     def add(self, curve):
         # check if this is a histogram
         try:
@@ -300,56 +461,99 @@ class PercentileCurve:
                 print("nbins: %d, size: %d" % (nbins, self.size))
                 return False
 
-            for ii in range(nbins):
-                c = curve.GetBinContent(ii+1)
-                self.points[ii].append(c)
+            y = [curve.GetBinContent(ii+1) for ii in range(nbins)]
         except:
             if len(curve) != self.size:
                 print("*** PercentileCurve - ERROR*** wrong number of points on curve")
                 print("len(curve): %d, size: %d" % (len(curve), self.size))
                 return False
 
-            for ii, y in enumerate(curve):
-                self.points[ii].append(y)
+            y = curve
+        self.append(y)
         return True
 
-    def __call__(self, percentile):
-        z = []
-        for ii in range(self.size):
-            points = self.points[ii]
-            points.sort()
-            np = len(points)
-
-            x = percentile * np
-            k = int(x)
-            f = x - k
-            c1= points[k]
-            if k < np-1:
-                c2 = points[k+1]
-                c  = c1*(1-f) + c2*f
+    # combine the curves of another PercentileCurve with these
+    def merge(self, other):
+        if other.size != self.size:
+            print("*** PercentileCurve - ERROR*** wrong number of points on curve")
+            print("size: %d, %d" % (self.size, other.size))
+            return False
+        if self.sketch != None:
+            if other.sketch != None:
+                if not self.sketch.merge(other.sketch): return False
             else:
-                c = c1				
-            z.append(c)
-        return z
+                for y in other.buffer[:other.ntoys]:
+                    self.sketch.add(y)
+        elif other.sketch != None:
+            print("*** PercentileCurve - ERROR*** "\
+                  "cannot merge a sketch into exact percentiles")
+            return False
+        else:
+            for y in other.buffer[:other.ntoys]:
+                self.append(y)
+            return True
+        self.ntoys += other.ntoys
+        return True
+
+    def percentiles(self, percent):
+        if self.sketch != None:
+            return self.sketch.quantiles(percent)
+        return percentilearray(self.buffer[:self.ntoys], percent)
+
+    def __call__(self, percentile):
+        return self.percentiles([percentile])[0].tolist()
 
     def curves(self, percentiles):
         from array import array
         lines = []
-        for p in percentiles:
+        for z in self.percentiles(percentiles):
             c = array('d')
-            c.fromlist(self.__call__(p))
+            c.fromlist(z.tolist())
             lines.append(c)
         return lines
 
+    # write curves (or the sketch) to a .npz file
+    def save(self, filename):
+        if self.sketch != None:
+            self.sketch.save(filename)
+        else:
+            np.savez(filename, points=self.buffer[:self.ntoys])
+
+    @staticmethod
+    def load(filename):
+        store = np.load(filename)
+        if 'points' in store.files:
+            points = store['points']
+            curve  = PercentileCurve(points.shape[1], len(points))
+            curve.buffer[:len(points)] = points
+            curve.ntoys = len(points)
+        else:
+            sketch = QuantileSketch.load(filename)
+            curve  = PercentileCurve(sketch.size, sketch=sketch.k)
+            curve.sketch = sketch
+            curve.ntoys  = sketch.count
+        return curve
+
 class StandardCurve:
 
+    # Running mean and variance of each point of the curve (Welford's
+    # algorithm), so memory does not grow with the number of curves.
     def __init__(self, size):
         self.size = size
-        self.points = [[] for x in size*[0]]
+        self.count= 0
+        self.mean = np.zeros(size, dtype=np.float64)
+        self.m2   = np.zeros(size, dtype=np.float64) # sum of squared deviations
 
     def __del__(self):
         pass
 
+    def append(self, y):
+        self.count += 1
+        y = np.asarray(y, dtype=np.float64)
+        delta = y - self.mean
+        self.mean += delta / self.count
+        self.m2   += delta * (y - self.mean)
+
     def add(self, curve):
 
         # check if this is a histogram
@@ -360,35 +564,45 @@ class StandardCurve:
                 print("nbins: %d, size: %d" % (nbins, self.size))
                 return False
 
-            for ii in range(nbins):
-                c = curve.GetBinContent(ii+1)
-                self.points[ii].append(c)
+            y = [curve.GetBinContent(ii+1) for ii in range(nbins)]
         except:
             if len(curve) != self.size:
                 print("*** StandardCurve - ERROR*** wrong number of points on curve")
                 print("len(curve): %d, size: %d" % (len(curve), self.size))
                 return False
 
-            for ii, y in enumerate(curve):
-                self.points[ii].append(y)
+            y = curve
+        self.append(y)
+        return True
+
+    # combine the curves of another StandardCurve with these (exact)
+    def merge(self, other):
+        if other.size != self.size:
+            print("*** StandardCurve - ERROR*** wrong number of points on curve")
+            print("size: %d, %d" % (self.size, other.size))
+            return False
+        n = self.count + other.count
+        if other.count == 0: return True
+        delta = other.mean - self.mean
+        self.mean += delta * other.count / n
+        self.m2   += other.m2 + delta**2 * self.count * other.count / n
+        self.count = n
         return True
 
+    def bands(self, sigmas):
+        # mean + nsigma * rms for every nsigma at once
+        rms = np.sqrt(self.m2 / self.count)
+        return self.mean + np.outer(sigmas, rms)
+
     def __call__(self, nsigma):
-        z = []
-        for ii in range(self.size):
-            points = self.points[ii]
-            c = sum(points)/len(points)
-            ec= sqrt(sum([(x-c)**2 for x in points])/len(points))
-            if nsigma != 0: c = c + nsigma * ec
-            z.append(c)
-        return z
+        return self.bands([nsigma])[0].tolist()
 
     def curves(self, sigmas):
         from array import array
         lines = []
-        for p in sigmas:
+        for z in self.bands(sigmas):
             c = array('d')
-            c.fromlist(self.__call__(p))
+            c.fromlist(z.tolist())
             lines.append(c)
         return lines
 #------------------------------------------------------------------------------
@@ -398,43 +612,31 @@ def getarg(args, key, d):
     else:
         return d
 #------------------------------------------------------------------------------
+# Return x as a contiguous float64 array that can be handed directly to
+# Root methods taking Double_t*. Lists, array('d'), buffers and NumPy
+# arrays are accepted; float64 arrays and buffers are not copied.
+def tobuffer(x):
+    return np.ascontiguousarray(x, dtype=np.float64)
+
 def mkpline(xx, y1, y2, boundary, **args):    
-    color  = getarg(args, 'color',   kYellow)
+    color  = getarg(args, 'color',   rt.kYellow)
     fstyle = getarg(args, 'fstyle',  3001)
     lwidth = getarg(args, 'lwidth',  2)
 
+    xx = tobuffer(xx)
+    y1 = tobuffer(y1)
+    y2 = tobuffer(y2)
     nbins = len(xx)
 
-    # lower curve
-    x = array('d')
-    if type(xx) == type([]):		
-        x.fromlist(xx)
-    else:
-        for z in xx: x.append(z)
-
-    y = array('d')
-    if type(y1) == type([]):
-        y.fromlist(y1)
-    else:
-        for z in y1: y.append(z)
-
-    # upper curve
-
-    for i in range(nbins):
-        j = nbins - i - 1
-        x.append(xx[j])
-        y.append(y2[j])
-
-    x.append(xx[0])
-    y.append(y1[0])
+    # lower curve, then upper curve in reverse, then close the polygon
+    x = np.concatenate((xx, xx[::-1], xx[:1]))
+    y = np.concatenate((y1[:nbins], y2[nbins-1::-1], y1[:1]))
 
     # clip polygon
-    np  = 2*nbins
-    npp = 2*np
-    xc = array('d')
-    xc.fromlist(npp*[0])
-    yc = array('d')
-    yc.fromlist(npp*[0])
+    npoints = 2*nbins
+    npp = 2*npoints
+    xc = np.zeros(npp)
+    yc = np.zeros(npp)
 
     if type(boundary) != type([]):
         xmin = boundary.GetBinLowEdge(1)
@@ -444,8 +646,9 @@ def mkpline(xx, y1, y2, boundary, **args):
     else:
         xmin, xmax, ymin, ymax = boundary
 
-    np = rt.gPad.ClipPolygon(np, x, y, npp, xc, yc, xmin, ymin, xmax, ymax)
-    pl = rt.TPolyLine(np, xc, yc)
+    npoints = rt.gPad.ClipPolygon(npoints, x, y, npp, xc, yc,
+                                  xmin, ymin, xmax, ymax)
+    pl = rt.TPolyLine(npoints, xc, yc)
     pl.SetLineColor(color)
     pl.SetLineWidth(lwidth)
     pl.SetFillColor(color)
@@ -528,6 +731,68 @@ def fixhist2(h, xtitle=None, ytitle=None, **args):
     h.GetYaxis().SetTitleOffset(1.6)
     h.SetNdivisions(ndivy, "Y")
 #------------------------------------------------------------------------------
+# Bulk filling: one FillN call for arrays x (and y) with optional weights
+def fillhist(h, x, y=None, weights=None):
+    x = np.ascontiguousarray(x, dtype=np.float64)
+    if weights is None:
+        w = np.ones(len(x), dtype=np.float64)
+    else:
+        w = np.ascontiguousarray(weights, dtype=np.float64)
+    if y is None:
+        h.FillN(len(x), x, w)
+    else:
+        y = np.ascontiguousarray(y, dtype=np.float64)
+        h.FillN(len(x), x, y, w)
+    return h
+
+# Set all bin contents (and optionally errors) in one call. contents is
+# either a Hist1/Hist2 (including under- and overflows), or an array of
+# in-range bins: contents[ix] for 1-D, contents[iy, ix] for 2-D histograms.
+def sethist(h, contents, errors=None):
+    entries = None
+    if isinstance(contents, (Hist1, Hist2)):
+        entries = contents.entries
+        if errors is None: errors = np.sqrt(contents.sumw2)
+        contents = contents.sumw
+        inner = False
+    else:
+        inner = True
+
+    def cells(a):
+        a = np.asarray(a, dtype=np.float64)
+        if not inner:
+            return np.ascontiguousarray(a.ravel())
+        c = np.zeros(h.GetNcells(), dtype=np.float64)
+        if h.GetDimension() == 1:
+            c[1:-1] = a
+        else:
+            nx = h.GetNbinsX()
+            c.reshape(-1, nx+2)[1:-1, 1:-1] = a
+        return c
+
+    h.SetContent(cells(contents))
+    if errors is not None:
+        h.SetError(cells(errors))
+    if entries is None:
+        entries = np.asarray(contents).sum()
+    h.SetEntries(entries)
+    return h
+
+# Create and fill a histogram from arrays in one call
+def mkhist1fill(hname, xtitle, ytitle, nbins, xmin, xmax, x,
+                weights=None, **args):
+    h = mkhist1(hname, xtitle, ytitle, nbins, xmin, xmax, **args)
+    if weights is not None: h.Sumw2()
+    return fillhist(h, x, weights=weights)
+
+def mkhist2fill(hname, xtitle, ytitle,
+                nbinx, xmin, xmax,
+                nbiny, ymin, ymax, x, y, weights=None, **args):
+    h = mkhist2(hname, xtitle, ytitle,
+                nbinx, xmin, xmax, nbiny, ymin, ymax, **args)
+    if weights is not None: h.Sumw2()
+    return fillhist(h, x, y, weights)
+#------------------------------------------------------------------------------
 def mkgraph(x, y, xtitle, ytitle, xmin, xmax, **args):
     ymin   = getarg(args, 'ymin', None)
     ymax   = getarg(args, 'ymax', None)
@@ -540,19 +805,12 @@ def mkgraph(x, y, xtitle, ytitle, xmin, xmax, **args):
     ndivy  = getarg(args, 'ndivy', 505)
     name   = getarg(args, 'name', None)
 
-    if y == None:
+    if y is None:
         g = rt.TGraph()
     else:
-        n = len(y)
-        xx = x
-        if type(x) == type([]):
-            xx = array('d')
-            for i in range(n): xx.append(x[i])
-        yy = y	
-        if type(y) == type([]):
-            yy = array('d')
-            for i in range(n): yy.append(y[i])
-
+        yy = tobuffer(y)
+        xx = tobuffer(x)
+        n  = min(len(xx), len(yy))
         g = rt.TGraph(n, xx, yy)
 
     if name != None: g.SetName(name)
@@ -586,24 +844,11 @@ def mkgraphErrors(x, y, ex, ey, xtitle, ytitle, xmin, xmax, **args):
     ndivx  = getarg(args, 'ndivx',   505)
     ndivy  = getarg(args, 'ndivy',   510)
 
-    n = len(y)
-    xx = x
-    if type(x) == type([]):
-        xx = array('d')
-        for i in range(n): xx.append(x[i])
-    yy = y	
-    if type(y) == type([]):
-        yy = array('d')
-        for i in range(n): yy.append(y[i])
-
-    exx = ex
-    if type(ex) == type([]):
-        exx = array('d')
-        for i in range(n): exx.append(ex[i])
-    eyy = ey	
-    if type(ey) == type([]):
-        eyy = array('d')
-        for i in range(n): eyy.append(ey[i])
+    xx  = tobuffer(x)
+    yy  = tobuffer(y)
+    exx = tobuffer(ex)
+    eyy = tobuffer(ey)
+    n = min(len(xx), len(yy), len(exx), len(eyy))
 
     g = rt.TGraphErrors(n, xx, yy, exx, eyy)
 
@@ -627,26 +872,57 @@ def mkgraphErrors(x, y, ex, ey, xtitle, ytitle, xmin, xmax, **args):
     g.GetHistogram().SetNdivisions(ndivy, "Y")
     return g
 #------------------------------------------------------------------------------
+# Return the contents of all cells of a histogram, including under- and
+# overflows (cell ix + (nx+2)*iy for 2-D), as a float64 array, reading
+# the histogram's storage in one go rather than bin by bin.
+HIST_DTYPES = [('TArrayD', np.float64), ('TArrayF', np.float32),
+               ('TArrayI', np.int32),   ('TArrayS', np.int16),
+               ('TArrayC', np.int8)]
+
+def getcontents(hist):
+    ncells = hist.GetNcells()
+    for name, dtype in HIST_DTYPES:
+        if hist.InheritsFrom(name): break
+    else:
+        return np.array([hist.GetBinContent(i) for i in range(ncells)])
+    buf = hist.GetArray()
+    if hasattr(buf, 'reshape'):
+        buf.reshape((ncells,))
+    else:
+        buf.SetSize(ncells)
+    return np.frombuffer(buf, dtype=dtype, count=ncells).astype(np.float64)
+
+# cumulative sum of bins minbin...nbins; the last element is the integral
 def mkcdf(hist, minbin=1):
-    c = [0.0]*(hist.GetNbinsX()-minbin+2)
-    j=0
-    for ibin in range(minbin, hist.GetNbinsX()+1):
-        c[j] = c[j-1] + hist.GetBinContent(ibin)
-        j += 1
-    c[j] = hist.Integral()
-    return c
-
-def mkroc(name, hsig, hbkg, lcolor=rt.kBlue, lwidth=2, ndivx=505, ndivy=505):
-    from array import array
-    csig = mkcdf(hsig)
-    cbkg = mkcdf(hbkg)
-    npts = len(csig)
-    esig = array('d')
-    ebkg = array('d')
-    for i in range(npts):
-        esig.append(1 - csig[npts-1-i])
-        ebkg.append(1 - cbkg[npts-1-i])
-    g = rt.TGraph(npts, ebkg, esig)
+    nbins = hist.GetNbinsX()
+    c = getcontents(hist)
+    return np.append(np.cumsum(c[minbin:nbins+1]), c[1:nbins+1].sum())
+
+# signal and background efficiencies for a cut x > x0 at every bin edge,
+# in order of increasing background efficiency
+def mkrocarrays(hsig, hbkg):
+    def efficiency(h):
+        c = mkcdf(h)
+        if c[-1] != 0: c = c / c[-1]
+        return 1 - c[::-1]
+    return (efficiency(hbkg), efficiency(hsig))
+
+# area under the ROC curve (trapezoidal rule), closed at (0,0) and (1,1)
+def rocauc(ebkg, esig):
+    x = np.concatenate(([0.0], ebkg, [1.0]))
+    y = np.concatenate(([0.0], esig, [1.0]))
+    return float(np.sum(0.5*(y[1:] + y[:-1])*np.diff(x)))
+
+# signal efficiency interpolated at the given background efficiencies
+# (background rejection = 1 - efficiency)
+def rocpoints(ebkg, esig, effb):
+    return np.interp(effb, ebkg, esig)
+
+# if arrays is True, return (graph, ebkg, esig) rather than the graph
+def mkroc(name, hsig, hbkg, lcolor=rt.kBlue, lwidth=2, ndivx=505, ndivy=505,
+          arrays=False):
+    ebkg, esig = mkrocarrays(hsig, hbkg)
+    g = rt.TGraph(len(esig), ebkg, esig)
     g.SetName(name)
     g.SetLineColor(lcolor)
     g.SetLineWidth(lwidth)
@@ -659,6 +935,8 @@ def mkroc(name, hsig, hbkg, lcolor=rt.kBlue, lwidth=2, ndivx=505, ndivy=505):
 
     g.GetHistogram().SetNdivisions(ndivx, "X")
     g.GetHistogram().SetNdivisions(ndivy, "Y")
+    if arrays:
+        return (g, ebkg, esig)
     return g
 
 def mklegend(xx, yy, xw, yw):
@@ -670,12 +948,14 @@ def mklegend(xx, yy, xw, yw):
     return lg
 #------------------------------------------------------------------------------
 class Row:
-    def __init__(self, rownumber, varmap, data):
+    def __init__(self, rownumber, varmap, data, items=None):
         self.row = rownumber
         self.varmap = varmap
         self.data = data
-        self.items = [(x[1],x[0]) for x in list(self.varmap.items())]
-        self.items.sort()
+        if items == None:
+            items = [(x[1],x[0]) for x in list(self.varmap.items())]
+            items.sort()
+        self.items = items
 
         # Initialize row counter
         self.col = 0
@@ -684,15 +964,18 @@ class Row:
     def __del__(self):
         pass
 
+    def value(self, index):
+        return self.data[index]
+
     def __call__(self, variable):
         if variable not in self.varmap: return None
         index = self.varmap[variable]
-        return self.data[index]
+        return self.value(index)
 
     def __str__(self):
         strrep = "ID: %d\n" % self.row
         for index, name in self.items:
-            value = self.data[index]
+            value = self.value(index)
             if type(value) != type(""):
                 strvalue = "%12.3f" % value
             else:
@@ -710,7 +993,7 @@ class Row:
             raise StopIteration
         else:
             index, name = self.items[self.col]
-            value = self.data[index]
+            value = self.value(index)
             self.col += 1
             return (name, value)
 
@@ -721,8 +1004,13 @@ class Row:
         if type(key) != type(1): return None
         if key < -len(self.varmap): return None
         if key > len(self.varmap)-1: return None
-        return self.data[key]
+        return self.value(key)
 
+class RowView(Row):
+    # A row of a columnar Table: data is the list of column arrays
+    # and values are fetched on demand, so nothing is copied.
+    def value(self, index):
+        return self.data[index][self.row]
 #------------------------------------------------------------------------------
 def tonumber(x):
     try:
@@ -731,9 +1019,128 @@ def tonumber(x):
         y = x
     return y
 
+def tocolumns(text, ncols):
+    # Convert the whitespace-delimited body of a table into a list of
+    # columns. Numeric columns are rows of a single contiguous float64
+    # block (so each column is contiguous); any column that does not
+    # convert to numbers is kept as an object array of tonumber values.
+    tokens = str.split(text)
+    if len(tokens) % ncols != 0:
+        raise ValueError("number of fields is not a multiple of %d" % ncols)
+    nrows = len(tokens) // ncols
+    try:
+        block = np.array(tokens, dtype=np.float64).reshape(nrows, ncols)
+        block = np.ascontiguousarray(block.T)
+        return [block[j] for j in range(ncols)]
+    except ValueError:
+        pass
+
+    numeric = []
+    strings = {}
+    for j in range(ncols):
+        try:
+            numeric.append((j, np.array(tokens[j::ncols], dtype=np.float64)))
+        except ValueError:
+            strings[j] = np.array(list(map(tonumber, tokens[j::ncols])),
+                                  dtype=object)
+    block = np.empty((len(numeric), nrows), dtype=np.float64)
+    columns = [None]*ncols
+    for k, (j, column) in enumerate(numeric):
+        block[k] = column
+        columns[j] = block[k]
+    for j, column in strings.items():
+        columns[j] = column
+    return columns
+
+#------------------------------------------------------------------------------
+# Binary sidecar cache for Table files. The numeric columns are stored
+# as a float64 block in <file>.cache.npy (memory-mapped on reading) and
+# the header, string columns and the source's path, size and mtime in
+# <file>.cache.json. A sidecar is used only if the source is unchanged.
+# Sidecars go next to the source, or, if $HISTUTIL_CACHE is defined, in
+# cachedir(), which creates the directory if need be.
+CACHE_VERSION = 1
+
+def cachename(filename):
+    filename = os.path.abspath(filename)
+    if os.environ.get('HISTUTIL_CACHE', '') == '':
+        return filename + '.cache'
+    from hashlib import md5
+    key = md5(filename.encode('utf-8')).hexdigest()
+    return os.path.join(cachedir(), '%s_%s.cache' % (nameonly(filename), key))
+
+def cachekey(filename):
+    st = os.stat(filename)
+    return {'version': CACHE_VERSION,
+            'source':  os.path.abspath(filename),
+            'size':    st.st_size,
+            'mtime':   st.st_mtime}
+
+def readcache(filename):
+    import json
+    name = cachename(filename)
+    try:
+        meta = json.load(open(name + '.json', 'r'))
+        key  = cachekey(filename)
+        for k in key:
+            if meta.get(k) != key[k]: return None
+        block = np.load(name + '.npy', mmap_mode='r')
+    except:
+        return None
+
+    header  = meta['header']
+    numeric = meta['numeric']
+    strings = meta['strings']
+    if block.shape[0] != len(numeric): return None
+    columns = [None]*len(header)
+    for k, j in enumerate(numeric):
+        columns[j] = block[k]
+    for j, values in strings.items():
+        columns[int(j)] = np.array(values, dtype=object)
+    return (header, columns)
+
+def writecache(filename, header, columns):
+    # write to temporary files and rename them into place so that
+    # concurrent jobs never see a partially written sidecar
+    import json
+    name = cachename(filename)
+    temp = '%s.%d' % (name, os.getpid())
+    try:
+        key = cachekey(filename)
+        numeric = [j for j, c in enumerate(columns) if c.dtype != object]
+        strings = dict([('%d' % j, list(c)) for j, c in enumerate(columns)
+                        if c.dtype == object])
+        block = np.empty((len(numeric), len(columns[0])), dtype=np.float64)
+        for k, j in enumerate(numeric):
+            block[k] = columns[j]
+        np.save(temp + '.npy', block)
+        os.rename(temp + '.npy', name + '.npy')
+
+        key['header']  = header
+        key['numeric'] = numeric
+        key['strings'] = strings
+        json.dump(key, open(temp + '.json', 'w'))
+        os.rename(temp + '.json', name + '.json')
+    except:
+        for ext in ['.npy', '.json']:
+            if os.path.exists(temp + ext): os.remove(temp + ext)
+        return False
+    return True
+
 class Table:
 
-    def __init__(self, filename, nrows=-1):
+    def __init__(self, filename, nrows=-1, columnar=True, cache=True):
+        self.columnar = columnar
+
+        # Use the binary sidecar, if it exists and is up to date
+        cache = cache and columnar and nrows <= 0
+        if cache:
+            cached = readcache(filename)
+            if cached != None:
+                self.header, self.columns = cached
+                self.initialize(len(self.columns[0]))
+                return
+
         try:
             myfile = open(filename, 'r')
         except:
@@ -741,49 +1148,85 @@ class Table:
             sys.exit(0)
 
         # Read header
-        records = myfile.readlines()
-        header  = str.split(records[0])
+        header  = str.split(myfile.readline())
         self.header = header
 
-        rownumber = 0
-        self.data = []
-        index = 1
-        for record in records[1:]:
-            # Convert to numbers
-            record = list(map(tonumber, str.split(record)))
-            self.data.append(record)
-            rownumber += 1
+        if columnar:
+            # Read body (only the first nrows records if requested)
             if nrows > 0:
-                if rownumber >= nrows:
-                    break
-        myfile.close()
+                from itertools import islice
+                text = ''.join(islice(myfile, nrows))
+            else:
+                text = myfile.read()
+            myfile.close()
+            try:
+                self.columns = tocolumns(text, len(header))
+            except ValueError:
+                # ragged rows: fall back to the list-of-rows layout
+                self.columnar = False
+                records = text.splitlines()
+        else:
+            records = myfile.readlines()
+            myfile.close()
 
+        if self.columnar:
+            nrecords = len(self.columns[0])
+            if cache: writecache(filename, header, self.columns)
+        else:
+            rownumber = 0
+            self.data = []
+            for record in records:
+                # Convert to numbers
+                record = list(map(tonumber, str.split(record)))
+                self.data.append(record)
+                rownumber += 1
+                if nrows > 0:
+                    if rownumber >= nrows:
+                        break
+            nrecords = len(self.data)
+
+        self.initialize(nrecords)
+
+    def initialize(self, nrecords):
         # Initialize row counter
         self.rownumber = 0
-        self.maxrow = len(self.data)-1
+        self.maxrow = nrecords-1
+        self.offset = 0
 
         # Create a name to index map
         self.varmap = {} # empty map
-        for index, name in enumerate(header):
+        for index, name in enumerate(self.header):
             self.varmap[name] = index
+        self.items = [(index, name) for name, index in self.varmap.items()]
+        self.items.sort()
 
         # Create a name to index map for rows
+        # (only needed by the list-of-rows column())
         self.rowmap = {} # empty map
-        for index in range(len(self.data)):
-            self.rowmap['%d' % index] = index            
+        if not self.columnar:
+            for index in range(nrecords):
+                self.rowmap['%d' % index] = index            
 
     def __del__(self):
         pass
 
+    def mkrow(self, rownumber):
+        if self.columnar:
+            return RowView(rownumber, self.varmap, self.columns, self.items)
+        else:
+            return Row(rownumber, self.varmap, self.data[rownumber], self.items)
+
     def __call__(self, rownumber, variable=None):
         if rownumber < 0: return None
         if rownumber > self.maxrow: return None
         if variable == None:
-            return Row(rownumber, self.varmap, self.data[rownumber])
+            return self.mkrow(rownumber)
         else:
             if variable not in self.varmap: return None
             index = self.varmap[variable]
-            return self.data[row][index]
+            if self.columnar:
+                return self.columns[index][rownumber]
+            return self.data[rownumber][index]
 
     # Implement Python iterator protocol
 
@@ -795,18 +1238,27 @@ class Table:
             self.rownumber = 0
             raise StopIteration
         else:
-            data = Row(self.rownumber,
-                       self.varmap,
-                       self.data[self.rownumber])
+            data = self.mkrow(self.rownumber)
             self.rownumber += 1
             return data
 
     def row(self, index):
         if index > self.maxrow: return None
-        data = Row(index, self.varmap, self.data[index])
-        return data
+        return self.mkrow(index)
 
     def column(self, index):
+        # In columnar mode, return a read-only view of the column
+        # (by name or index); no data are copied.
+        if self.columnar:
+            if type(index) == type(""):
+                if index not in self.varmap: return None
+                index = self.varmap[index]
+            if index < -len(self.columns): return None
+            if index > len(self.columns)-1: return None
+            data = self.columns[index].view()
+            data.flags.writeable = False
+            return data
+
         if index > self.maxrow: return None
         d = [0]*len(self.data)
         for ii in range(len(self.data)):
@@ -830,17 +1282,271 @@ class Table:
         if type(key) != type(1): return None
         if key < -(self.maxrow+1): return None
         if key > self.maxrow: return None
-        return Row(key, self.varmap, self.data[key])
+        if key < 0: key += self.maxrow+1
+        return self.mkrow(key)
+
+    # Read a table file incrementally: yield a TableChunk of at most
+    # chunksize rows at a time, so memory use is independent of the
+    # file size. chunk.offset is the row number of the chunk's first row.
+    # Raises ValueError if the rows have different lengths.
+    @staticmethod
+    def iter_chunks(filename, chunksize=100000):
+        from itertools import islice
+        try:
+            myfile = open(filename, 'r')
+        except:
+            print("*** can't read file %s" % filename)
+            sys.exit(0)
+
+        try:
+            header = str.split(myfile.readline())
+            offset = 0
+            while True:
+                text = ''.join(islice(myfile, chunksize))
+                if text == '': break
+                try:
+                    columns = tocolumns(text, len(header))
+                except ValueError:
+                    raise ValueError("ragged rows in file %s" % filename)
+                if len(columns[0]) == 0: continue
+                yield TableChunk(header, columns, offset)
+                offset += len(columns[0])
+        finally:
+            myfile.close()
+
+class TableChunk(Table):
+    # a block of consecutive rows of a table file (see Table.iter_chunks)
+    def __init__(self, header, columns, offset=0):
+        self.header = header
+        self.columnar = True
+        self.columns = columns
+        self.initialize(len(columns[0]))
+        self.offset = offset
+#------------------------------------------------------------------------------
+# Return the named columns of a RooDataSet as float64 arrays. Recent
+# versions of Root read all of them at once (RooDataSet.to_numpy);
+# otherwise the rows are read once, filling all columns together.
+def datasetcolumns(data, names):
+    if type(names) == type(''): names = names.split()
+    if hasattr(data, 'to_numpy'):
+        try:
+            d = data.to_numpy()
+            return [np.asarray(d[name], dtype=np.float64) for name in names]
+        except Exception:
+            pass
+    n = data.numEntries()
+    columns = [np.empty(n) for name in names]
+    for i in range(n):
+        row = data.get(i)
+        for c, name in zip(columns, names):
+            c[i] = row[name].getVal()
+    return columns
+
+# Split data by the category cat in a single pass over the data (see
+# RooAbsData::split) rather than with one cut per category. Returns
+# (parts, sums): parts maps each category label to its dataset (without
+# cat) and, if groups is given, sums maps each group name to the sum of
+# the datasets of the categories whose labels match any of the group's
+# glob patterns, e.g., groups = {'7TeV': ['h7_*'], '8TeV': ['h8_*']}.
+def split_by_category(data, cat, groups=None):
+    from fnmatch import fnmatchcase
+    datasets = data.split(cat, True)
+    parts = {}
+    labels = []
+    for d in datasets:
+        parts[d.GetName()] = d
+        labels.append(d.GetName())
+
+    sums = {}
+    if groups == None: return (parts, sums)
+    for name, patterns in groups.items():
+        if type(patterns) == type(''): patterns = [patterns]
+        total = None
+        for label in labels:
+            if not any([fnmatchcase(label, p) for p in patterns]): continue
+            if total == None:
+                total = parts[label].Clone(name)
+                total.SetTitle(name)
+            elif total.InheritsFrom('RooDataHist'):
+                total.add(parts[label])
+            else:
+                total.append(parts[label])
+        if total == None:
+            print("*** split_by_category - WARNING *** no categories "\
+                  "match group %s" % name)
+        sums[name] = total
+    return (parts, sums)
+#------------------------------------------------------------------------------
+# Struct layouts already declared in this process (see Ntuple)
+NTUPLE_STRUCTS = set()
+
+def cachedir():
+    # directory for cached build products: $HISTUTIL_CACHE, if
+    # defined, or ~/.cache/histutil
+    path = os.environ.get('HISTUTIL_CACHE', '')
+    if path == '':
+        path = os.path.join(os.path.expanduser('~'), '.cache', 'histutil')
+    if not os.path.exists(path):
+        try:
+            os.makedirs(path)
+        except OSError:
+            pass
+    return path
+
+def declareStructs(name, recs):
+    # Compile the struct declarations recs with ACLiC (see buildLibrary,
+    # which keys the build on the Root version and the declarations and
+    # serialises concurrent builds), or load the library if it has been
+    # built already; if that is not possible, JIT them with
+    # gROOT.ProcessLine
+    import tempfile, shutil
+    tempdir = tempfile.mkdtemp()
+    header  = os.path.join(tempdir, '%s.h' % name)
+    library = None
+    try:
+        out = open(header, 'w')
+        out.write('#ifndef %s_H\n#define %s_H\n' % (name, name))
+        for rec in recs:
+            out.write('%s\n' % rec)
+        out.write('#endif\n')
+        out.close()
+        library = buildLibrary(header, jit=False)
+    except:
+        pass
+    finally:
+        shutil.rmtree(tempdir, True)
+    if library != None:
+        return True
+    for rec in recs:
+        rt.gROOT.ProcessLine(rec)
+    return False
+#------------------------------------------------------------------------------
+# Return func() called with Root's implicit multi-threading turned off,
+# then restore it. An RDataFrame created within func then processes the
+# entries in order, which Range requires and which reads whose results
+# must line up with the entries of a chain rely on.
+def singlethreaded(func):
+    if not (hasattr(rt, 'IsImplicitMTEnabled') and rt.IsImplicitMTEnabled()):
+        return func()
+    if hasattr(rt, 'GetThreadPoolSize'):
+        nthreads = rt.GetThreadPoolSize()
+    else:
+        nthreads = rt.GetImplicitMTPoolSize()
+    rt.DisableImplicitMT()
+    try:
+        return func()
+    finally:
+        rt.EnableImplicitMT(nthreads)
+#------------------------------------------------------------------------------
+# Model libraries loaded in this process (see buildLibrary)
+MODEL_LIBRARIES = {}
+
+def sourcefiles(filename, files=None):
+    # filename and, recursively, the files it includes with
+    # #include "..." that exist relative to its directory (absolute
+    # includes are left alone)
+    if files == None: files = []
+    if filename in files: return files
+    files.append(filename)
+    text = open(filename).read()
+    for name in re.findall(r'^\s*#\s*include\s*"([^"]+)"', text, re.M):
+        if os.path.isabs(name): continue
+        path = os.path.join(os.path.dirname(filename), name)
+        if os.path.exists(path):
+            sourcefiles(os.path.abspath(path), files)
+    return files
+
+def buildLibrary(filename, options='kO', jit=True):
+    # Compile the C++ source filename (optimised) with ACLiC into a
+    # directory of cachedir() named after a hash of the Root version and
+    # of the source and its local includes, then load the library with
+    # gSystem.Load in later jobs. A change to any of the sources gives a
+    # new directory, and so a rebuild. If ACLiC fails and jit is True the
+    # source is JIT compiled with gROOT.ProcessLine. Returns the library
+    # name, or None.
+    filename = os.path.abspath(filename)
+    if filename in MODEL_LIBRARIES:
+        return MODEL_LIBRARIES[filename]
+    if not os.path.exists(filename):
+        print("*** buildLibrary - ERROR *** can't find file %s" % filename)
+        return None
+
+    from hashlib import md5
+    import shutil
+    files = sourcefiles(filename)
+    key = md5(str(rt.gROOT.GetVersionCode()).encode('utf-8'))
+    for name in files:
+        key.update(open(name, 'rb').read())
+    stem, ext = os.path.splitext(os.path.basename(filename))
+    models   = os.path.join(cachedir(), 'models')
+    builddir = os.path.join(models, '%s_%s' % (stem, key.hexdigest()[:16]))
+
+    # the sources are copied, keeping their relative layout, below the
+    # directory that contains them all, so that includes such as
+    # "../common/x.h" stay inside builddir and the library (which
+    # refers to the sources) does not depend on the working directory
+    top = [os.path.dirname(x).split(os.sep) for x in files]
+    common = top[0]
+    for parts in top[1:]:
+        n = 0
+        while n < min(len(common), len(parts)) and common[n] == parts[n]:
+            n += 1
+        common = common[:n]
+    top = os.sep.join(common) or os.sep
+    srcdir  = os.path.join(builddir, 'src')
+    source  = os.path.join(srcdir, os.path.relpath(filename, top))
+    library = os.path.join(os.path.dirname(source), '%s_%s.%s' % \
+                           (stem, ext[1:], rt.gSystem.GetSoExt()))
+    try:
+        import fcntl
+    except ImportError:
+        fcntl = None
+    try:
+        if not os.path.exists(models):
+            try:
+                os.makedirs(models)
+            except OSError:
+                pass
+        # one job builds the library while concurrent jobs wait for it
+        # rather than compiling into the same directory
+        lock = open(builddir + '.lock', 'a')
+        try:
+            if fcntl != None: fcntl.flock(lock, fcntl.LOCK_EX)
+            if os.path.exists(library):
+                ok = rt.gSystem.Load(library) >= 0
+            else:
+                for name in files:
+                    target = os.path.join(srcdir, os.path.relpath(name, top))
+                    if not os.path.exists(os.path.dirname(target)):
+                        os.makedirs(os.path.dirname(target))
+                    shutil.copy2(name, target)
+                ok = rt.gSystem.CompileMacro(source, options) == 1
+        finally:
+            lock.close()
+    except Exception:
+        ok = False
+    if not ok:
+        library = None
+        if not jit: return library
+        print("*** buildLibrary - WARNING *** unable to build library "\
+              "for %s; JIT compiling it" % filename)
+        rt.gROOT.ProcessLine('.L %s' % filename)
+    MODEL_LIBRARIES[filename] = library
+    return library
 #------------------------------------------------------------------------------
 class Buffer:
 
-    def __init__(self, buffer, buffermap, variable):
+    # activate, if given, is called with the name of each variable
+    # accessed (see Ntuple's lazy mode)
+    def __init__(self, buffer, buffermap, variable, activate=None):
+        self.activate = activate
         self.buffer = buffer
         self.buffermap = buffermap
         self.variable = variable
 
     def __getattr__(self, variable):
         if variable in self.buffermap:
+            if self.activate != None: self.activate(variable)
             jj = self.buffermap[variable]
             return self.buffer[jj].__getattribute__(variable)
         else:
@@ -856,14 +1562,34 @@ class Buffer:
 class Ntuple:
     # "self" is Python's equivalent of the "this" pointer in C++
     # self points to the memory allocated for the object
-
-    def __init__(self, filename, treename, nrows=None):
+    #
+    # branches: list of branch names or glob patterns (e.g. "jet*");
+    #           only these branches are set up and read (default: all)
+    # lazy:     if True, a branch is activated (SetBranchStatus) only
+    #           when it is first accessed through get() or the event
+    #           object, so only branches actually used are read
+    # cut:      selection, e.g. "pt > 25 && abs(eta) < 2.4", compiled
+    #           once (RDataFrame Filter) to find the selected entries;
+    #           the Ntuple then contains only these entries
+    # entrylist: where to keep the selected entry numbers so that
+    #           later jobs need not apply the cut again: the name of a
+    #           .npz file, True for a file in cachedir() keyed by the
+    #           input files and the cut, or an array of entry numbers
+
+    def __init__(self, filename, treename, nrows=None,
+                 branches=None, lazy=False, cut=None, entrylist=None):
 
         # cache inputs
         self.status = 0
+        self.lazy = lazy
+        self.active = set()
+        self.localentry = -1
+        self.options = {'branches': branches, 'lazy': lazy,
+                        'cut': cut, 'entrylist': entrylist}
+        self.bulkchain = None
+        self.cut = cut
+        self.selected = None
 
-        from random import randint
-        self.postfix  = randint(1, 1000000)
         if type(filename) == type(""):
             self.filename = [filename]
         else:
@@ -919,11 +1645,11 @@ class Ntuple:
             sys.exit(0)
 
         # get names of variables from root file
-        branches  = tree.GetListOfBranches()
+        blist = tree.GetListOfBranches()
 
         # get number of variables
         try:
-            nbranches = branches.GetEntries()
+            nbranches = blist.GetEntries()
         except:
             print("** ====>  problem accessing branches\n")
             self.status = -1
@@ -931,9 +1657,10 @@ class Ntuple:
 
         bnamemap = {}        
         self.vars = []
+        self.counter = {} # map from array branch to its counter branch
         for i in range(nbranches):
             # get the ith branch (aka variable)
-            bname = branches[i].GetName()
+            bname = blist[i].GetName()
             			
             # just in case, check for duplicates!
             if bname in bnamemap:
@@ -944,7 +1671,7 @@ class Ntuple:
             
             # assume one leaf/branch
             # Get all leaves associated with this branch
-            leaves = branches[i].GetListOfLeaves()
+            leaves = blist[i].GetListOfLeaves()
             if leaves == None:
                 print("No leaves found!")
                 sys.exit(0)
@@ -960,15 +1687,42 @@ class Ntuple:
             tname = leaf.GetTypeName()
 
             #check for leaf counter
-            flag = Long(0)
+            if hasattr(rt, 'Long'):
+                flag = rt.Long(0)     # older PyROOT
+            else:
+                import ctypes
+                flag = ctypes.c_int(0)
             leafcounter = leaf.GetLeafCounter(flag)
             if leafcounter:
                 maxcount = leafcounter.GetMaximum()
+                self.counter[bname] = leafcounter.GetBranch().GetName()
             else:
                 maxcount = leaf.GetLen()
 
             # store type and variable name
             self.vars.append( (tname, bname, maxcount) )
+
+        # keep only the selected branches (and the counters they need)
+        if branches != None:
+            from fnmatch import fnmatchcase
+            if type(branches) == type(""): branches = [branches]
+            names = set()
+            for tname, bname, maxcount in self.vars:
+                for pattern in branches:
+                    if fnmatchcase(bname, pattern):
+                        names.add(bname)
+                        if bname in self.counter:
+                            names.add(self.counter[bname])
+                        break
+            self.vars = [v for v in self.vars if v[1] in names]
+
+        # activate the branches to be read
+        if lazy or branches != None:
+            tree.SetBranchStatus('*', 0)
+            if not lazy:
+                for tname, bname, maxcount in self.vars:
+                    tree.SetBranchStatus(bname, 1)
+                    self.active.add(bname)
                 
         nlen = len(self.vars)
 
@@ -977,6 +1731,11 @@ class Ntuple:
         for ind, var in enumerate(self.vars):
             self.varmap[var] = ind
 
+        # find the entries that pass the cut
+        if cut != None:
+            self.selected = self.select(cut, entrylist)
+            self.entries = len(self.selected)
+
         # initialize row number
         self.row = 0
         nentries = self.entries
@@ -991,14 +1750,21 @@ class Ntuple:
         # into multiple strings
         # ------------------------------------
 
+        # the struct names are derived from the schema (branch types,
+        # names and sizes) so that a layout is declared only once per
+        # process and its compiled dictionary can be reused across jobs
+        from hashlib import md5
+        schema = repr([(str(t), str(n), int(m)) for t, n, m in self.vars])
+        self.postfix = md5(schema.encode('utf-8')).hexdigest()[:16]
+
         bufferCount = 0
         newBuffer = True
         rec = ""
         bufferName = ""
         maxlength  = 2000
         self.buffermap  = {}
-        self.buffer = []
-
+        bufferNames = []
+        recs = []
 
         for count, (tname, name, maxcount) in enumerate(self.vars):
 
@@ -1007,7 +1773,7 @@ class Ntuple:
 
             if newBuffer:
                 newBuffer = False
-                bufferName = "S%d_%d" % (self.postfix, bufferCount)
+                bufferName = "S%s_%d" % (self.postfix, bufferCount)
                 rec = "struct %s {" % bufferName
 
             if maxcount == 1:
@@ -1019,27 +1785,29 @@ class Ntuple:
                    (count >= len(self.vars)-1):
                 rec += "};"
                 newBuffer = True
-
-                # evaluate it
-
-                rt.gROOT.ProcessLine(rec)
-
-                # now import struct
-                exec("from ROOT import %s" % bufferName)
-
-                # add to list of buffers
-                self.buffer.append(eval("%s()" % bufferName))
+                bufferNames.append(bufferName)
+                recs.append(rec)
 
                 # remember to update buffer count
                 bufferCount += 1
 
+        # declare structs (if not done already) and create buffers
+        if len(recs) > 0 and self.postfix not in NTUPLE_STRUCTS:
+            declareStructs('ntuple_S%s' % self.postfix, recs)
+            NTUPLE_STRUCTS.add(self.postfix)
+        self.buffer = [getattr(rt, x)() for x in bufferNames]
+
         # create a generic event object
-        self.event = Buffer(self.buffer, self.buffermap, self.vars)
+        if lazy:
+            self.event = Buffer(self.buffer, self.buffermap, self.vars,
+                                self.activate)
+        else:
+            self.event = Buffer(self.buffer, self.buffermap, self.vars)
 
         # Now that addresses are stable, give address of each variable
         for tname, name, maxcount in self.vars:
             jj = self.buffermap[name]
-            tree.SetBranchAddress(name, AddressOf(self.buffer[jj], name))
+            tree.SetBranchAddress(name, rt.AddressOf(self.buffer[jj], name))
 
         self.status = 0
         self.row = 0
@@ -1054,7 +1822,11 @@ class Ntuple:
     def numEntries(self):
         return self.entries
 
+    # read row 0 <= row < size(); if a cut or entry list is set, rows
+    # are numbered among the selected entries only
     def read(self, row):
+        if self.selected is not None:
+            row = int(self.selected[row])
         localentry = self.chain.LoadTree(row)
         if self.chain.GetTreeNumber() != self.currentTreeNumber:
                     self.currentTreeNumber = self.chain.GetTreeNumber()
@@ -1064,8 +1836,9 @@ class Ntuple:
                     self.tree  = self.chain.GetTree()
                     for tname, name, maxcount in self.vars:
                         jj = self.buffermap[name]
-                        self.tree.SetBranchAddress(name, AddressOf(self.buffer[jj], name))
+                        self.tree.SetBranchAddress(name, rt.AddressOf(self.buffer[jj], name))
 
+        self.localentry = localentry
         self.tree.GetEntry(localentry)
 
         def treeNumber(self):
@@ -1074,8 +1847,158 @@ class Ntuple:
         def good(self):
             return self.status == 0
 
+    # Read branches (default: all) for entries [start, stop) in bulk,
+    # returning a dictionary of NumPy arrays keyed by branch name.
+    # Only the requested branches are read, and there is no per-entry
+    # Python code.
+    def arrays(self, branches=None, start=0, stop=None):
+        if branches == None:
+            branches = [name for tname, name, maxcount in self.vars]
+        if stop == None or stop > self.entries:
+            stop = self.entries
+        if start >= stop:
+            return dict([(name, np.empty(0)) for name in branches])
+        if self.selected is not None:
+            # selected entries start, ..., stop-1 are the entries
+            # passing the cut in this range of the chain
+            first = int(self.selected[start])
+            last  = int(self.selected[stop-1]) + 1
+        else:
+            first = start
+            last  = stop
+        # single-threaded: Range is not allowed with implicit
+        # multi-threading, and the arrays must be in entry order
+        chain = self.bulk()
+        def read():
+            df = rt.RDataFrame(chain)
+            if first > 0 or last < chain.GetEntries():
+                df = df.Range(first, last)
+            if self.cut != None:
+                df = df.Filter(self.cut)
+            return df.AsNumpy(list(branches))
+        columns = singlethreaded(read)
+        return dict([(name, np.asarray(columns[name])) for name in branches])
+
+    # a separate chain for bulk reads, so that branch statuses
+    # set on self.chain do not affect them
+    def bulk(self):
+        if self.bulkchain == None:
+            self.bulkchain = rt.TChain(self.treename)
+            for fname in self.filename:
+                self.bulkchain.Add(fname)
+        return self.bulkchain
+
+    # return the (sorted) numbers of the chain entries passing cut,
+    # using or updating the persisted list (see entrylist above)
+    def select(self, cut, entrylist=None):
+        if entrylist is not None and type(entrylist) != type('') \
+               and type(entrylist) != type(True):
+            return np.asarray(entrylist, dtype=np.int64)
+
+        from hashlib import md5
+        key = [self.treename, cut]
+        for fname in self.filename:
+            st = os.stat(fname)
+            key.append((os.path.abspath(fname), st.st_size, st.st_mtime))
+        key = md5(repr(key).encode('utf-8')).hexdigest()
+        if entrylist == True:
+            entrylist = os.path.join(cachedir(), 'entries_%s.npz' % key)
+        elif type(entrylist) == type('') and not entrylist.endswith('.npz'):
+            entrylist += '.npz'
+
+        if entrylist:
+            try:
+                store = np.load(entrylist)
+                if str(store['key']) == key:
+                    return store['entries']
+            except:
+                pass
+
+        # single-threaded: with implicit multi-threading rdfentry_ is
+        # not the entry number of the chain
+        def read():
+            df = rt.RDataFrame(self.bulk()).Filter(cut)
+            return df.Define('entry_', 'rdfentry_').AsNumpy(['entry_'])
+        entries = singlethreaded(read)
+        entries = np.sort(np.asarray(entries['entry_'], dtype=np.int64))
+
+        if entrylist:
+            temp = '%s.%d.npz' % (entrylist[:-4], os.getpid())
+            try:
+                np.savez(temp, key=key, entries=entries)
+                os.rename(temp, entrylist)
+            except:
+                if os.path.exists(temp): os.remove(temp)
+        return entries
+
+    # Run func(ntuple, start, stop) over partitions of the Ntuple using
+    # a pool of nworkers processes and return the list of results in
+    # order. The partitions are entry ranges of at most chunksize entries
+    # (if chunksize > 0), or, if byfile is True, the individual files.
+    # Each worker opens the Ntuple (with the same branches and lazy
+    # settings) once, so func must be picklable, e.g., a module-level
+    # function or an instance of a module-level class.
+    def map(self, func, nworkers=1, chunksize=0, byfile=False):
+        options = dict(self.options)
+        if byfile:
+            tasks  = list(self.filename)
+            worker = mapFile
+            filename = None
+            # each file has its own entry list
+            if type(options['entrylist']) not in [type(''), type(True)]:
+                options['entrylist'] = None
+            elif options['entrylist']:
+                options['entrylist'] = True
+        else:
+            tasks  = entryRanges(self.entries, nworkers, chunksize)
+            worker = mapRange
+            filename = self.filename
+            options['entrylist'] = self.selected
+
+        if nworkers > 1:
+            from multiprocessing import Pool
+            pool = Pool(nworkers, ntupleWorkerInit,
+                        (filename, self.treename, options, func))
+            try:
+                return pool.map(worker, tasks, 1)
+            finally:
+                pool.close()
+                pool.join()
+
+        NTUPLE_WORKER['ntuple']   = self
+        NTUPLE_WORKER['treename'] = self.treename
+        NTUPLE_WORKER['options']  = options
+        NTUPLE_WORKER['func']     = func
+        return [worker(x) for x in tasks]
+
+    # As map(), then combine the results in the parent process with
+    # reducer(a, b), e.g., lambda a, b: a.Add(b) or a for histograms
+    # or merge() for PercentileCurve and StandardCurve accumulators.
+    def map_reduce(self, func, reducer, nworkers=1, chunksize=0, byfile=False):
+        from functools import reduce
+        results = self.map(func, nworkers, chunksize, byfile)
+        if len(results) == 0: return None
+        return reduce(reducer, results)
+
+    # Loop over the Ntuple in blocks of step_size entries, yielding
+    # the dictionary of arrays returned by arrays() for each block.
+    def iterate(self, branches=None, step_size=100000):
+        for start, stop in entryRanges(self.entries, 1, step_size):
+            yield self.arrays(branches, start, stop)
+
+    # activate a branch (lazy mode) and read it for the current entry
+    def activate(self, variable):
+        if variable in self.active: return
+        if variable in self.counter:
+            self.activate(self.counter[variable])
+        self.active.add(variable)
+        self.chain.SetBranchStatus(variable, 1)
+        if self.localentry >= 0:
+            self.tree.GetBranch(variable).GetEntry(self.localentry)
+
     def get(self, variable):
         if variable in self.buffermap:
+            if self.lazy: self.activate(variable)
             jj = self.buffermap[variable]
             return self.buffer[jj].__getattribute__(variable)
         else:
@@ -1110,6 +2033,52 @@ class Ntuple:
             self.row += 1
             return self.event
 #------------------------------------------------------------------------------
+# Process-pool helpers for Ntuples: each worker process opens its own
+# Ntuple once (ROOT objects cannot be sent between processes) and then
+# processes the entry ranges it is given.
+NTUPLE_WORKER = {}
+
+def ntupleWorkerInit(filename, treename, options, func):
+    # filename == None: the worker opens one Ntuple per file (see mapFile)
+    if filename != None:
+        NTUPLE_WORKER['ntuple'] = Ntuple(filename, treename, **options)
+    NTUPLE_WORKER['treename'] = treename
+    NTUPLE_WORKER['options']  = options
+    NTUPLE_WORKER['func']     = func
+
+def mapRange(entries):
+    start, stop = entries
+    return NTUPLE_WORKER['func'](NTUPLE_WORKER['ntuple'], start, stop)
+
+def mapFile(filename):
+    ntuple = Ntuple(filename, NTUPLE_WORKER['treename'],
+                    **NTUPLE_WORKER['options'])
+    return NTUPLE_WORKER['func'](ntuple, 0, ntuple.size())
+
+def entryRanges(nentries, nchunks, chunksize=0):
+    # split [0, nentries) into at least nchunks ranges
+    # of at most chunksize entries (if chunksize > 0)
+    step = max(1, (nentries + nchunks - 1) // max(1, nchunks))
+    if chunksize > 0: step = min(step, chunksize)
+    return [(start, min(start+step, nentries))
+            for start in range(0, nentries, step)]
+
+def readVariables(ntuple, variables, start, stop):
+    columns = ntuple.arrays(variables, start, stop)
+    x = np.empty((stop-start, len(variables)), dtype=np.float64)
+    for jj, name in enumerate(variables):
+        x[:, jj] = columns[name]
+    return x
+
+class BDTScorer:
+    # Ntuple.map() function that scores entries [start, stop) with a Forest
+    def __init__(self, forest, variables):
+        self.forest = forest
+        self.variables = variables
+
+    def __call__(self, ntuple, start, stop):
+        return self.forest(readVariables(ntuple, self.variables, start, stop))
+#------------------------------------------------------------------------------
 class Node:
     def __init__(self,
                  left, right, selector, cutValue,
@@ -1157,30 +2126,243 @@ class Node:
         return self.response
 
 #------------------------------------------------------------------------------
+class Forest:
+    # A BDT forest in struct-of-arrays form: node i of the forest has
+    # variable selector[i], cut cutValue[i], cut type cutType[i],
+    # children left[i] and right[i] (-1 for none), node type nodeType[i],
+    # purity[i] and response[i]. roots[t] is the root node of tree t.
+    def __init__(self, weights, selector, cutValue, cutType,
+                 left, right, nodeType, purity, response, roots):
+        self.weights  = np.asarray(weights,  dtype=np.float64)
+        self.selector = np.asarray(selector, dtype=np.int32)
+        self.cutValue = np.asarray(cutValue, dtype=np.float64)
+        self.cutType  = np.asarray(cutType,  dtype=bool)
+        self.left     = np.asarray(left,     dtype=np.int32)
+        self.right    = np.asarray(right,    dtype=np.int32)
+        self.nodeType = np.asarray(nodeType, dtype=np.int32)
+        self.purity   = np.asarray(purity,   dtype=np.float64)
+        self.response = np.asarray(response, dtype=np.float64)
+        self.roots    = np.asarray(roots,    dtype=np.int32)
+        self.depth    = self.maxdepth()
+
+        # for the evaluator: children[i] = (next node if x <= cut,
+        # next node if x > cut), with leaves pointing to themselves so
+        # that events stop at their leaf
+        leaf = self.nodeType != 0
+        index = np.arange(len(self.nodeType), dtype=np.int32)
+        left  = np.where(self.cutType, self.left, self.right)
+        right = np.where(self.cutType, self.right, self.left)
+        self.children = np.empty((len(index), 2), dtype=np.int32)
+        self.children[:, 0] = np.where(leaf, index, left)
+        self.children[:, 1] = np.where(leaf, index, right)
+        self.select = np.where(leaf, 0, self.selector)
+
+    def __del__(self):
+        pass
+
+    def maxdepth(self):
+        depth = 0
+        nodes = self.roots
+        while len(nodes) > 0:
+            nodes = nodes[self.nodeType[nodes] == 0]
+            nodes = np.concatenate([self.left[nodes], self.right[nodes]])
+            nodes = nodes[nodes >= 0]
+            depth += 1
+        return depth
+
+    @staticmethod
+    def fromNodes(weights, forest):
+        selector = []; cutValue = []; cutType  = []
+        left     = []; right    = []; nodeType = []
+        purity   = []; response = []; roots    = []
+        for tree in forest:
+            roots.append(len(selector))
+            stack = [(tree, -1, left)]
+            while len(stack) > 0:
+                node, parent, child = stack.pop()
+                if node == 0 or node == None: continue
+                index = len(selector)
+                if parent >= 0: child[parent] = index
+                selector.append(node.selector)
+                cutValue.append(node.cutValue)
+                cutType.append(node.cutType)
+                nodeType.append(node.nodeType)
+                purity.append(node.purity)
+                response.append(node.response)
+                left.append(-1)
+                right.append(-1)
+                stack.append((node.right, index, right))
+                stack.append((node.left,  index, left))
+        return Forest(weights, selector, cutValue, cutType,
+                      left, right, nodeType, purity, response, roots)
+
+    def numTrees(self):
+        return len(self.roots)
+
+    # rebuild tree itree as Node objects
+    def tree(self, itree):
+        def node(i):
+            if i < 0: return 0
+            return Node(node(self.left[i]), node(self.right[i]),
+                        int(self.selector[i]), float(self.cutValue[i]),
+                        int(self.cutType[i]), int(self.nodeType[i]),
+                        float(self.purity[i]), float(self.response[i]))
+        return node(self.roots[itree])
+
+    def save(self, filename, key=''):
+        np.savez(filename, key=key,
+                 weights=self.weights, selector=self.selector,
+                 cutValue=self.cutValue, cutType=self.cutType,
+                 left=self.left, right=self.right, nodeType=self.nodeType,
+                 purity=self.purity, response=self.response, roots=self.roots)
+
+    @staticmethod
+    def load(filename):
+        store = np.load(filename)
+        return Forest(store['weights'], store['selector'],
+                      store['cutValue'], store['cutType'],
+                      store['left'], store['right'], store['nodeType'],
+                      store['purity'], store['response'], store['roots'])
+
+    def __call__(self, inputValues, numTrees=-1, blocksize=0):
+        # score an (nevents x nvars) array; every tree is walked for a
+        # block of events at once (by default, a block whose node indices
+        # fit in cache). The sum over trees is done in the same
+        # order as BDT.__call__ so that the results are identical.
+        x = np.asarray(inputValues, dtype=np.float64)
+        if x.ndim == 1: x = x[np.newaxis, :]
+
+        totalTrees = len(self.roots)
+        if numTrees > 0:
+            ntrees = min(numTrees, totalTrees)
+        else:
+            ntrees = totalTrees
+        roots   = self.roots[:ntrees]
+        weights = self.weights[:ntrees]
+        norm = 0.0
+        for w in weights.tolist(): norm += w
+
+        if blocksize <= 0:
+            blocksize = max(64, 262144 // max(1, ntrees))
+        nvars = x.shape[1]
+        value = np.empty(len(x), dtype=np.float64)
+        for start in range(0, len(x), blocksize):
+            block = x[start:start+blocksize]
+            flat  = block.ravel()
+            rows  = nvars * np.arange(len(block))
+            nodes = np.repeat(roots[:, np.newaxis], len(block), axis=1)
+            for depth in range(self.depth-1):
+                result = flat[rows + self.select[nodes]] > self.cutValue[nodes]
+                nodes = self.children[nodes, result.view(np.int8)]
+            # cumsum adds the trees in order, as BDT.__call__ does
+            v = np.cumsum(weights[:, np.newaxis] * self.nodeType[nodes], axis=0)
+            v = v[-1]
+            value[start:start+len(block)] = v / norm
+        return value
+#------------------------------------------------------------------------------
+# Read the forest of a TMVA BDT C++ class file directly into a Forest.
+# Each tree is a nest of node constructors
+#   NN(left, right, selector, cutValue, cutType, nodeType, purity, response)
+# where a missing child is 0; no code is executed.
+def parseForest(record):
+    gettree   = re.compile('^  [/][/] itree[^)]+[)];[^;]+;', re.M)
+    getweight = re.compile('fBoostWeights[.]push_back[(]([^)]+)[)]')
+    gettoken  = re.compile(r'NN[(]|[)]|[-+]?(?:\d+[.]?\d*|[.]\d+)(?:[eE][-+]?\d+)?')
+
+    weights  = []; roots    = []
+    selector = []; cutValue = []; cutType  = []
+    left     = []; right    = []; nodeType = []
+    purity   = []; response = []
+    for rec in gettree.findall(record):
+        weights.append(float(getweight.search(rec).group(1)))
+        roots.append(len(selector))
+        body  = rec[rec.index('fForest.push_back'):]
+        stack = []
+        for token in gettoken.findall(body):
+            if token == 'NN(':
+                index = len(selector)
+                if len(stack) > 0: stack[-1][1].append(index)
+                stack.append((index, []))
+                selector.append(0); cutValue.append(0); cutType.append(0)
+                left.append(-1); right.append(-1); nodeType.append(0)
+                purity.append(0); response.append(0)
+            elif token == ')':
+                if len(stack) == 0: continue # end of push_back(...)
+                index, args = stack.pop()
+                if len(args) != 8:
+                    raise ValueError("node with %d arguments" % len(args))
+                # children are node indices (ints); 0.0 means no child
+                if type(args[0]) == type(1): left[index]  = args[0]
+                if type(args[1]) == type(1): right[index] = args[1]
+                selector[index] = int(args[2])
+                cutValue[index] = args[3]
+                cutType[index]  = int(args[4])
+                nodeType[index] = int(args[5])
+                purity[index]   = args[6]
+                response[index] = args[7]
+            elif len(stack) > 0:
+                stack[-1][1].append(float(token))
+    return Forest(weights, selector, cutValue, cutType,
+                  left, right, nodeType, purity, response, roots)
+
+class Trees:
+    # list-like view of a Forest as trees of Node objects,
+    # each built when first needed
+    def __init__(self, forest):
+        self.flatforest = forest
+        self.trees = {}
+
+    def __len__(self):
+        return self.flatforest.numTrees()
+
+    def __getitem__(self, itree):
+        if itree < 0: itree += len(self)
+        if itree < 0 or itree >= len(self): raise IndexError(itree)
+        if itree not in self.trees:
+            self.trees[itree] = self.flatforest.tree(itree)
+        return self.trees[itree]
+#------------------------------------------------------------------------------
 class BDT:
-    def __init__(self, filename):        
-        import re
+    # The parsed forest is cached in <filename>.cache.npz (or in
+    # $HISTUTIL_CACHE), keyed by the md5 hash of the class file.
+    def __init__(self, filename, cache=True):
         from os import path
         from sys import exit
+        from hashlib import md5
         if not path.exists(filename):
             print('** BDT ** error ** cannot open file %s' % filename)
             exit()
 
-        record = open(filename).read()
-        gettree = re.compile('^  [/][/] itree[^)]+[)];[^;]+;', re.M)
-        recs = gettree.findall(record)
-        self.weights = []
-        self.forest  = []
-
-        for index, record in enumerate(recs):
-            record = record.replace( 'NN(', 'Node(')
-            record = record.replace('  //','#')
-            record = record.replace('  fBoostWeights.push_back','self.weights.append')
-            record = record.replace('  fForest.push_back','self.forest.append')
-            record = record.replace(';','')
-            exec(record)
-            if index % 100 == 0:
-                print(index)
+        record = open(filename, 'rb').read()
+        key = md5(record).hexdigest()
+        cached = cachename(filename) + '.npz'
+        forest = None
+        if cache:
+            try:
+                if str(np.load(cached)['key']) == key:
+                    forest = Forest.load(cached)
+            except:
+                forest = None
+
+        if forest == None:
+            try:
+                forest = parseForest(record.decode('utf-8'))
+            except ValueError as e:
+                print('** BDT ** error ** cannot parse file %s: %s' % \
+                      (filename, e))
+                exit()
+            if cache:
+                temp = '%s.%d.npz' % (cachename(filename), os.getpid())
+                try:
+                    forest.save(temp, key)
+                    os.rename(temp, cached)
+                except:
+                    if path.exists(temp): os.remove(temp)
+
+        # flattened forest for batch evaluation
+        self.flatforest = forest
+        self.weights = forest.weights.tolist()
+        self.forest  = Trees(forest)
 
     def __del__(self):
         pass
@@ -1207,6 +2389,50 @@ class BDT:
         value /= norm
         return value
 
+    # score many events at once: inputValues is an (nevents x nvars) array
+    def evaluate(self, inputValues, numTrees=-1):
+        return self.flatforest(inputValues, numTrees)
+
+    # score every entry of an Ntuple, using nworkers processes, each of
+    # which reads and scores ranges of at most chunksize entries.
+    # variables are the names of the BDT inputs, in order. If friend
+    # is given, the scores are also written to branch name of tree name
+    # in the Root file friend, for use with TTree::AddFriend. A friend
+    # tree needs one entry per entry of the chain, so entries not scored
+    # (rejected by the cut of the Ntuple, or beyond nrows) are given the
+    # value default.
+    def score_ntuple(self, ntuple, variables, nworkers=1, chunksize=100000,
+                     friend=None, name='bdt', default=-999.0):
+        scores = ntuple.map(BDTScorer(self.flatforest, variables),
+                            nworkers, chunksize)
+        if len(scores) > 0:
+            scores = np.concatenate(scores)
+        else:
+            scores = np.empty(0, dtype=np.float64)
+
+        if friend != None:
+            values = scores
+            nentries = ntuple.chain.GetEntries()
+            if ntuple.selected is not None:
+                values = np.full(nentries, default, dtype=np.float64)
+                values[ntuple.selected[:len(scores)]] = scores
+            elif len(scores) != nentries:
+                values = np.full(nentries, default, dtype=np.float64)
+                values[:len(scores)] = scores
+
+            # write the branch in one go from the array (RDF.FromNumpy
+            # in Root 6.28 and later, RDF.MakeNumpyDataFrame before),
+            # single-threaded so that the entries stay in order
+            if hasattr(rt.RDF, 'FromNumpy'):
+                fromnumpy = rt.RDF.FromNumpy
+            else:
+                fromnumpy = rt.RDF.MakeNumpyDataFrame
+            values = np.ascontiguousarray(values, dtype=np.float64)
+            def write():
+                fromnumpy({name: values}).Snapshot(name, friend)
+            singlethreaded(write)
+        return scores
+
     def printTree(self, itree, varnames, depth=0, which=0, node=None):
         if which == 0:
             node = self.forest[itree]
@@ -0,0 +1,114 @@
+#-----------------------------------------------------------------------------
+# Pure NumPy 1-D and 2-D histograms with Root's binning conventions
+# (bin 0 = underflow, bin nbins+1 = overflow). These do not need Root;
+# use histutil.sethist to copy them into TH1/TH2 objects.
+#-----------------------------------------------------------------------------
+from __future__ import absolute_import
+from __future__ import print_function
+import numpy as np
+#-----------------------------------------------------------------------------
+def binindex(x, nbins, xmin, xmax):
+    # Root bin number of each x (0 = underflow, nbins+1 = overflow),
+    # computed as in TAxis::FindBin
+    x = np.asarray(x, dtype=np.float64)
+    t = np.clip(nbins*(x - xmin)/(xmax - xmin), 0, nbins)
+    i = 1 + t.astype(np.int64)
+    i[x <  xmin] = 0
+    i[~(x < xmax)] = nbins + 1
+    return i
+
+class Hist1:
+
+    def __init__(self, nbins, xmin, xmax):
+        self.nbins = nbins
+        self.xmin  = xmin
+        self.xmax  = xmax
+        self.sumw  = np.zeros(nbins+2, dtype=np.float64)
+        self.sumw2 = np.zeros(nbins+2, dtype=np.float64)
+        self.entries = 0
+
+    def __del__(self):
+        pass
+
+    def fill(self, x, weights=None):
+        x = np.asarray(x, dtype=np.float64)
+        keep = ~np.isnan(x)
+        x = x[keep]
+        i = binindex(x, self.nbins, self.xmin, self.xmax)
+        if weights is None:
+            w = None
+            w2= None
+        else:
+            w = np.asarray(weights, dtype=np.float64)[keep]
+            w2= w*w
+        n = self.nbins + 2
+        self.sumw  += np.bincount(i, weights=w,  minlength=n)
+        self.sumw2 += np.bincount(i, weights=w2, minlength=n)
+        self.entries += len(x)
+
+    def edges(self):
+        return np.linspace(self.xmin, self.xmax, self.nbins+1)
+
+    def centers(self):
+        e = self.edges()
+        return 0.5*(e[:-1] + e[1:])
+
+    def contents(self):
+        return self.sumw[1:-1]
+
+    def errors(self):
+        return np.sqrt(self.sumw2[1:-1])
+
+    def add(self, other):
+        self.sumw  += other.sumw
+        self.sumw2 += other.sumw2
+        self.entries += other.entries
+
+class Hist2:
+
+    def __init__(self, nbinx, xmin, xmax, nbiny, ymin, ymax):
+        self.nbinx = nbinx
+        self.xmin  = xmin
+        self.xmax  = xmax
+        self.nbiny = nbiny
+        self.ymin  = ymin
+        self.ymax  = ymax
+        # cells (ix, iy) in Root order: global bin = ix + (nbinx+2)*iy
+        self.sumw  = np.zeros((nbiny+2, nbinx+2), dtype=np.float64)
+        self.sumw2 = np.zeros((nbiny+2, nbinx+2), dtype=np.float64)
+        self.entries = 0
+
+    def __del__(self):
+        pass
+
+    def fill(self, x, y, weights=None):
+        x = np.asarray(x, dtype=np.float64)
+        y = np.asarray(y, dtype=np.float64)
+        keep = ~(np.isnan(x) | np.isnan(y))
+        x = x[keep]
+        y = y[keep]
+        ix = binindex(x, self.nbinx, self.xmin, self.xmax)
+        iy = binindex(y, self.nbiny, self.ymin, self.ymax)
+        i  = ix + (self.nbinx+2)*iy
+        if weights is None:
+            w = None
+            w2= None
+        else:
+            w = np.asarray(weights, dtype=np.float64)[keep]
+            w2= w*w
+        n = self.sumw.size
+        self.sumw  += np.bincount(i, weights=w,  minlength=n).reshape(self.sumw.shape)
+        self.sumw2 += np.bincount(i, weights=w2, minlength=n).reshape(self.sumw.shape)
+        self.entries += len(x)
+
+    # contents[iy, ix] excluding under- and overflows
+    def contents(self):
+        return self.sumw[1:-1, 1:-1]
+
+    def errors(self):
+        return np.sqrt(self.sumw2[1:-1, 1:-1])
+
+    def add(self, other):
+        self.sumw  += other.sumw
+        self.sumw2 += other.sumw2
+        self.entries += other.entries